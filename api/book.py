@@ -3,68 +3,15 @@ This stores the classes used for the text mining project.
 """
 
 import os
-import requests
-import re
-from scipy.sparse import dok_matrix
+from collections.abc import Mapping
 import numpy as np
-import matplotlib.pyplot as plt
-
-# define constants
-start_indicator = "*** START OF"
-end_indicator = " ***\n"
-contractions = {
-    "aren't": "are not",
-    "can't": "cannot",
-    "couldn't": "could not",
-    "didn't": "did not",
-    "doesn't": "does not",
-    "don't": "dont",  # Special case to not change; as in: why don't you do something doesn't translate well to why
-    "hadn't": "had not",  # do not you do something.
-    "hasn't": "has not",
-    "haven't": "have not",
-    "he'd": "he would",
-    "he'll": "he will",
-    "he's": "he is",
-    "i'd": 'i would',
-    "i'll": "i will",
-    "i'm": "i am",
-    "i've": "i have",
-    "isn't": "is not",
-    "let's": "let us",
-    "mightn't": "might not",
-    "mustn't": "must not",
-    "shan't": "shall not",
-    "she'd": "she would",
-    "she'll": "she will",
-    "she's": "she is",
-    "shouldn't": "should not",
-    "that's": "that is",
-    "there's": "there is",
-    "they'd": "they would",
-    "they'll": "they will",
-    "they're": "they are",
-    "they've": "they have",
-    "we'd": "we would",
-    "we're": "we are",
-    "we've": "we have",
-    "weren't": "were not",
-    "what'll": "what will",
-    "what're": "what are",
-    "what's": "what is",
-    "what've": "what have",
-    "where's": "where is",
-    "who'd": "who would",
-    "who'll": "who will",
-    "who're": "who are",
-    "who's": "who is",
-    "who've": "who have",
-    "won't": "will not",
-    "wouldn't": "would not",
-    "you'd": "you would",
-    "you'll": "you will",
-    "you're": "you are",
-    "you've": "you have"
-}
+from api import compression as compression_module, model_store, sampling, tokenizer
+from api import instrumentation as instrumentation_module
+from api.cache import LRUCache, array_key
+from api.instrumentation import timed
+from api.tokenizer import contractions  # noqa: F401 (contractions used to be defined in this module)
+
+default_cache_dir = "cache"  # the book texts and compiled models are stored in <cache_dir>/books/
 
 
 class InvalidBookError(Exception):
@@ -72,18 +19,72 @@ class InvalidBookError(Exception):
     pass
 
 
+class _TokenView:
+    """
+    Read-only sequence of the words of a token id array, decoded on access (indexing with a slice returns a list).
+    """
+    __slots__ = ("_words", "_token_ids")
+
+    def __init__(self, words, token_ids):
+        self._words = words
+        self._token_ids = token_ids
+
+    def __len__(self):
+        return len(self._token_ids)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self._words[i] for i in self._token_ids[k].tolist()]
+        return self._words[self._token_ids[k]]
+
+    def __iter__(self):
+        return (self._words[i] for i in self._token_ids.tolist())
+
+
+class _VocabularyView(Mapping):
+    """
+    Read-only {word: number of occurrences} mapping over a book's words and word_counts, in matrix index order.
+    """
+    __slots__ = ("_book",)
+
+    def __init__(self, book):
+        self._book = book
+
+    def __getitem__(self, word):
+        return self._book.word_counts[self._book.vocab_to_matrix[word]].item()
+
+    def __contains__(self, word):
+        return word in self._book.vocab_to_matrix
+
+    def __iter__(self):
+        return iter(self._book.words)
+
+    def __len__(self):
+        return len(self._book.words)
+
+
 class Book:
     """
     A book object stores all relevant information about the book (identified by
     name_author) and provides methods for processing each book's data.
+
+    The text is stored as an int32 array of matrix indices (token_ids) plus one table of the word at each matrix index
+    (words); tokens, vocabulary and vocab_to_matrix are views derived from them on demand.
     """
+    __slots__ = ("name_author", "book_text", "truncate", "token_ids", "word_counts", "num_words", "vocabulary_size",
+                 "n", "alpha", "max_chain", "graphs", "_words", "_vocab_to_matrix", "successor_offsets",
+                 "successor_ids", "rng", "sum_w_d_p_list_s_cache", "_last_candidates", "path_to_book", "path_to_model",
+                 "downloader", "instrumentation", "compression", "row_sums", "prior", "log_prior", "normalized_graphs")
 
     def __init__(self, name_author, gutenberg_index_dict, override_existing_download=False, do_make_book=True,
-                 truncate=0.01, n=2, max_chain=10, alpha=1):
+                 truncate=0.01, n=2, max_chain=10, alpha=1, book_text=None, use_compiled_model=False,
+                 downloader=None, cache_size=4096, seed=None, instrumentation=None, compression=None, precompute=False,
+                 normalize_graphs=False, cache_dir=default_cache_dir):
         self.name_author = name_author
         self.book_text = ""
         self.truncate = truncate
-        self.tokens = []
+        self.token_ids = np.zeros(0, dtype=np.int32)
+        self.word_counts = np.zeros(0, dtype=int)
         self.num_words = 0
         self.vocabulary_size = 0
         self.n = n
@@ -91,118 +92,224 @@ class Book:
         self.max_chain = max_chain
         self.graphs = [None] * self.max_chain
 
-        self.vocabulary = dict()
-        self.following_word = dict()
-        self.vocab_to_matrix = dict()
-        self.sum_w_d_p_list_s_cache = dict()
+        self.words = []  # the word at each matrix index
+        # CSR-style index of the words following each word: the matrix indices of the words that follow the word with
+        # index i are successor_ids[successor_offsets[i]:successor_offsets[i + 1]]
+        self.successor_offsets = np.zeros(1, dtype=np.int32)
+        self.successor_ids = np.zeros(0, dtype=np.int32)
+        self.rng = np.random.default_rng(seed)
+        # normalizers of _p_d_i_j, keyed by (distance, previous word index, array_key of the suggested word indices);
+        # only the per-word _p_d_i_j API reads it, since _cond_prob_segments computes all normalizers of a step at once
+        self.sum_w_d_p_list_s_cache = LRUCache(cache_size)
+        # (tuple_s, suggested word indices, their array_key) of the last call to _p_d_i_j; replaced as a whole, so that
+        # threads sharing the book never pair one tuple_s with another's indices
+        self._last_candidates = (None, None, None)
 
-        self.path_to_book = os.path.join("cache", "books", self.name_author + ".txt")
+        self.path_to_book = os.path.join(cache_dir, "books", self.name_author + ".txt")
+        self.path_to_model = model_store.compiled_model_path(self.path_to_book)
+        self.downloader = downloader  # created on the first download if None
+        # timers and counters of the _make stages and generation hot paths (see api/instrumentation.py); shared by all
+        # books of a Librarian, and disabled by default
+        self.instrumentation = instrumentation if instrumentation is not None else instrumentation_module.disabled
+        # the options of each compress call applied to the graphs (see compress); compression is a dictionary of
+        # keyword arguments of compress to apply whenever the model is built
+        self.compression = None
+        # probability tables derived from the graphs and word counts (see precompute_tables); None until precomputed
+        self.row_sums = None
+        self.prior = None
+        self.log_prior = None
+        self.normalized_graphs = None
 
-        if os.path.exists(self.path_to_book):  # Check if the book already exists and override it if indicated.
+        if book_text is not None:  # text supplied directly (e.g. synthetic corpora); skip the cache and download
+            self.book_text = book_text
+        elif os.path.exists(self.path_to_book):  # Check if the book already exists and override it if indicated.
             print("Book file already exists")
             if override_existing_download:
                 print("Overriding existing download: deleting {}".format(self.path_to_book))
                 os.remove(self.path_to_book)
+                self.download_book(gutenberg_index_dict)  # populates self.book_text
             else:
-                book_file = open(self.path_to_book, 'r')
+                book_file = open(self.path_to_book, 'r', encoding='utf-8')
                 self.book_text = book_file.read()
                 book_file.close()
         else:  # download book
             self.download_book(gutenberg_index_dict)  # populates self.book_text
 
         if do_make_book:
-            self.make_book(gutenberg_index_dict)
+            if compression is not None:  # only load a compiled model that was compressed the same way
+                self.compression = [compression_module.compression_options(self.max_chain, **compression)]
+            if not (use_compiled_model and self.load_compiled_model()):
+                self.compression = None
+                self.make_book(gutenberg_index_dict)
+                if compression is not None:
+                    self.compress(**compression)
+                if use_compiled_model:
+                    self.save_compiled_model()
+            if precompute:
+                self.precompute_tables(normalize_graphs)
+
+    @property
+    def words(self):
+        """
+        :return: list of the word at each matrix index
+        """
+        return self._words
+
+    @words.setter
+    def words(self, words):
+        self._words = words
+        self._vocab_to_matrix = None
+
+    @property
+    def vocab_to_matrix(self):
+        """
+        :return: dictionary mapping each word to its matrix index (built on first use)
+        """
+        if self._vocab_to_matrix is None:
+            self._vocab_to_matrix = {word: i for i, word in enumerate(self._words)}
+        return self._vocab_to_matrix
+
+    @property
+    def tokens(self):
+        """
+        :return: read-only sequence of the book's words, decoded from token_ids on access
+        """
+        return _TokenView(self._words, self.token_ids)
+
+    @property
+    def vocabulary(self):
+        """
+        :return: read-only mapping of each vocabulary word to its number of occurrences
+        """
+        return _VocabularyView(self)
 
     def download_book(self, gutenberg_index_dict):
+        """
+        Downloads the book from the Project Gutenberg mirror (see downloader.Downloader), writes it to
+        self.path_to_book and populates self.book_text.
+        :param gutenberg_index_dict: mapping of name_author to ebook number (e.g. gutindex.GutenbergIndex)
+        :return: void
+        """
+        import requests
+        from api.downloader import Downloader, DownloadError
+
         book_number = gutenberg_index_dict.get(self.name_author)
         if book_number is None:
             print("Book name/author not in the index.")
             raise InvalidBookError
 
-        book_link_number = ''
-        for i in range(1, len(book_number)):
-            # generating the unique part of the download link for the book
-            book_link_number = book_link_number + book_number[i - 1:i] + "/"
-        book_link_number = book_link_number + book_number + "/" + book_number + ".txt"
-
+        if self.downloader is None:
+            self.downloader = Downloader()
         try:
             print("Downloading {}".format(self.name_author))
-            self.book_text = requests.get("http://mirrors.xmission.com/gutenberg/{}".format(book_link_number)).text
-            if self.book_text[0:6] == "<html>":  # some links require a different format which is handled below
-                book_link_number = book_link_number[0:len(book_link_number) - 4] + "-0.txt"
-                self.book_text = requests.get("http://mirrors.xmission.com/gutenberg/{}".format(book_link_number)).text
-        except requests.exceptions.MissingSchema:
-            print("Invalid url / could not download from this link")
+            self.downloader.download_book(book_number, self.path_to_book)
+        except (DownloadError, requests.exceptions.RequestException) as e:
+            print("Invalid url / could not download from this link ({})".format(e))
             raise InvalidBookError
 
-        # if the text has an indicator of where the book starts, this will cut off the header
-        if self.book_text.__contains__(start_indicator):
-            self.book_text= self.book_text.split(start_indicator, 1)[1]
-
-        # if the text has an indicator of where the book ends, this will cut off the part following the end
-        if self.book_text.__contains__(end_indicator):
-            self.book_text = self.book_text.split(end_indicator, 1)[0]
-
-
-        book_file = open(self.path_to_book, 'w')
-        book_file.write(self.book_text)
+        book_file = open(self.path_to_book, 'r', encoding='utf-8')
+        self.book_text = book_file.read()
         book_file.close()
         print("Successfully downloaded {} and wrote to file".format(self.name_author))
 
     @staticmethod
     def _parse(s):
-        s = s.lower()  # Convert to lowercases
-        s = re.sub('\n', ' ', s)  # Replace \n with spaces
-        # remove contractions
-        for contraction in contractions:
-            s = re.sub(contraction, contractions[contraction], s)
-        s = re.sub("'", '', s)  # delete all apostrophes
-        s = re.sub(r'[^a-zA-Z0-9\s]', ' ', s)  # Replace all non alphanumeric characters with spaces
-        s = re.sub(' +', ' ', s)  # Replace series of spaces with single space
-        return s.split(" ")
+        """
+        Splits s into lowercase words, expanding contractions and dropping apostrophes and all other non alphanumeric
+        characters (see tokenizer.tokenize).
+        :return: list of words
+        """
+        return tokenizer.tokenize(s)
 
+    @timed("make_tokens")
     def _make_tokens(self):
         """
-        Tokenizes a book into a list of words and writes the data as text file
-        (data is pickled).
+        Tokenizes a book into the int32 array of the matrix indices of its words (self.token_ids) and the table of the
+        word at each matrix index (self.words). Matrix indices are assigned in order of first occurrence, so that they
+        (and seeded generation) are the same in every process.
         @param truncate: remove the first and last `truncate`% words from the book (to ignore things like the title,
          table of contents, chapters, etc.)
         """
-        s = self.book_text
-        self.tokens = self._parse(s)
-        self.num_words = len(self.tokens)
+        tokens = self._parse(self.book_text)
+        index = {}
+        all_ids = np.fromiter((index.setdefault(token, len(index)) for token in tokens), dtype=np.int32,
+                              count=len(tokens))
+        del tokens  # only the ids are kept
         if self.truncate != 0.:
-            truncate_amt = round(self.num_words * self.truncate)
-            self.tokens = self.tokens[truncate_amt:-truncate_amt]
-        if self.tokens.__contains__(""): self.tokens.remove("")  # remove any empty characters
-        self.num_words = len(self.tokens)
+            truncate_amt = round(len(all_ids) * self.truncate)
+            all_ids = all_ids[truncate_amt:-truncate_amt]
+        # renumber the words that remain in order of their first occurrence in the truncated text
+        present_ids, first_occurrences = np.unique(all_ids, return_index=True)
+        order = present_ids[np.argsort(first_occurrences)]
+        remap = np.zeros(len(index), dtype=np.int32)
+        remap[order] = np.arange(len(order), dtype=np.int32)
+        all_words = list(index.keys())
+        self.words = [all_words[i] for i in order.tolist()]
+        self.token_ids = remap[all_ids]
+        self.num_words = len(self.token_ids)
 
+    @timed("make_vocab")
     def _make_vocab(self):
-        self.vocabulary = {vocab: 0 for vocab in set(self.tokens)}
-        self.vocabulary_size = len(self.vocabulary)
-        for token in self.tokens: self.vocabulary[token] += 1
-
-    def _make_following_word_dict(self):
-        for vocab in self.vocabulary.keys(): self.following_word[vocab] = set()
-        for t in range(self.num_words-1): self.following_word[self.tokens[t]].add(self.tokens[t+1])
+        """
+        Counts the occurrences of each matrix index.
+        :return: void
+        """
+        self.vocabulary_size = len(self.words)
+        self.word_counts = np.bincount(self.token_ids, minlength=self.vocabulary_size)
 
+    @timed("make_bayesian_graphs")
     def _make_bayesian_graphs(self):
         """
         Build the list of bayesian graphs, where the graph at index i represents the directional graph between words in
-        the text vector (self.tokens), where the nodes are vocabulary words and the directional edges are the number of
-        occurrences of the parent node separated by the child node by distance i in the text.
+        the text vector (self.token_ids), where the nodes are vocabulary words and the directional edges are the number
+        of occurrences of the parent node separated by the child node by distance i in the text.
+
+        Each graph is built from the token id array shifted against itself by distance d; duplicate (parent, child)
+        pairs are summed when the COO matrix is converted to CSR.
+        :return: void
+        """
+        from scipy.sparse import coo_matrix
+
+        print('Building graph for {}'.format(self.name_author))
+        shape = (self.vocabulary_size, self.vocabulary_size)
+        self.graphs = []
+        for d in range(1, self.max_chain + 1):
+            parents = self.token_ids[:-d] if d < len(self.token_ids) else self.token_ids[:0]
+            children = self.token_ids[d:]
+            graph = coo_matrix((np.ones(len(parents), dtype=np.int32), (parents, children)), shape=shape).tocsr()
+            graph.sum_duplicates()  # also sorts the column indices of each row
+            self.graphs.append(self._compact_counts(graph))
+        print("Finished building graph for {}\n".format(self.name_author))
+
+    @staticmethod
+    def _compact_counts(graph):
+        """
+        Summing the duplicates of a CSR graph leaves views into the arrays of the unsummed pairs; copies them out,
+        storing integer counts in the smallest unsigned dtype that holds the largest count (mostly uint8 or uint16).
+        :param graph: csr_matrix whose duplicates have been summed
+        :return: graph
+        """
+        graph.indices = graph.indices.copy()
+        if graph.data.dtype.kind in "iu":
+            graph.data = graph.data.astype(np.min_scalar_type(graph.data.max() if graph.nnz else 0))
+        else:
+            graph.data = graph.data.copy()
+        return graph
+
+    def _make_bayesian_graphs_dok(self):
+        """
+        Reference implementation of _make_bayesian_graphs that increments one dok_matrix entry at a time. Kept for
+        benchmarking and for checking the vectorized build against (see benchmarks/bench_graph_build.py).
         :return: void
         """
+        from scipy.sparse import dok_matrix
+
         print('Building graph for {}'.format(self.name_author))
         self.graphs = []
         for i in range(self.max_chain):
             self.graphs.append(dok_matrix((self.vocabulary_size, self.vocabulary_size), dtype=int))
-        self.vocab_to_matrix = {}
-        for i, vocab in enumerate(self.vocabulary.keys()): self.vocab_to_matrix[
-            vocab] = i  # record what matrix index corresponds to which word; values are arbitrary as long as they
-        # remain unchanged and are unique to their respective key
-
-        for t, token in enumerate(self.tokens):
+        token_ids = self.token_ids.tolist()
+        for t, token_id in enumerate(token_ids):
 
             # enable the last `self.max_chain` words in the text serve as the basis for the search window by shortening
             # the search window so that it doesn't overextend the list of words
@@ -212,19 +319,37 @@ class Book:
                 upper_limit = self.num_words - t
 
             for c in range(1, upper_limit):  # iterate over search window
-                self.graphs[c - 1][self.vocab_to_matrix[token], self.vocab_to_matrix[self.tokens[c + t]]] += 1
+                self.graphs[c - 1][token_id, token_ids[c + t]] += 1
         print("Finished building graph for {}\n".format(self.name_author))
 
+    @timed("make_successor_index")
+    def _make_successor_index(self):
+        """
+        Builds self.successor_offsets and self.successor_ids, which are the row pointers and column indices of the
+        bayesian graph for distance 1 (the words following each word are the columns of its row).
+        :return: void
+        """
+        self.successor_offsets = self.graphs[0].indptr.astype(np.int32, copy=False)
+        self.successor_ids = self.graphs[0].indices.astype(np.int32, copy=False)
+
+    @timed("query_graph")
     def query_graph(self, d, _from, _to):
         """
         Returns the value of the directional edge from _from to _to in graph d, where d is the distance value associated
         with the graph. If there is no edge (an edge will exist if its value is >= 1), then 0 is returned
         :param d: distance
-        :param _from: start node
-        :param _to: end node
+        :param _from: start node (word or matrix index)
+        :param _to: end node (word or matrix index)
         :return: edge value
         """
-        return self.graphs[d][self.vocab_to_matrix[_from], self.vocab_to_matrix[_to]]
+        return self.graphs[d][self._id_of(_from), self._id_of(_to)].item()
+
+    def _id_of(self, word):
+        """
+        :param word: word or matrix index
+        :return: matrix index of the word
+        """
+        return self.vocab_to_matrix[word] if isinstance(word, str) else word
 
     def make_book(self, gutenberg_index):
         """
@@ -233,113 +358,677 @@ class Book:
         """
         self._make_tokens()
         self._make_vocab()
-        self._make_following_word_dict()
         self._make_bayesian_graphs()
+        self._make_successor_index()
+        self._refresh_tables()
+
+    @timed("precompute_tables")
+    def precompute_tables(self, normalize_graphs=False):
+        """
+        Precomputes what scoring otherwise derives from the raw counts at every step: the sum of each row of each graph
+        (row_sums), the prior P(s) of every word (prior) and its smoothed log, log(P(s) + alpha) (log_prior).
+        Generation and scoring then gather the smoothed log-prior instead of dividing the word counts and taking the
+        log. They find empty graph rows from the row pointers whether or not the tables were precomputed; row_sums only
+        lets the per-word _p_d_i_j skip rows whose sum is 0, and is what normalize_graphs divides by.
+
+        If normalize_graphs, the graphs are also stored row-normalized (normalized_graphs, w_d(p, s) / sum_s w_d(p, s)
+        as float64, sharing the index arrays of the count graphs), and generation reads its edge weights from them
+        instead of from the count graphs. Normalizing over the suggested words cancels the row sum, so the conditional
+        probabilities are the same up to floating point rounding; the normalized data takes 8 bytes per edge.
+
+        The tables are recomputed by make_book, update, compress and when a compiled model is loaded; call this again
+        after changing alpha.
+        :param normalize_graphs: also store the row-normalized graphs
+        :return: void
+        """
+        # the sum of each row is the difference of the cumulative sums of the counts at the row pointers
+        self.row_sums = [np.diff(np.concatenate(([0.], np.cumsum(graph.data, dtype=np.float64)))[graph.indptr])
+                         for graph in self.graphs]
+        self.prior = self.word_counts / self.num_words if self.num_words else np.zeros(self.vocabulary_size)
+        self.log_prior = np.log(self.prior + self.alpha)
+        if normalize_graphs:
+            from scipy.sparse import csr_matrix
+
+            self.normalized_graphs = []
+            for graph, row_sums in zip(self.graphs, self.row_sums):
+                data = graph.data / np.repeat(row_sums, np.diff(graph.indptr))
+                self.normalized_graphs.append(csr_matrix((data, graph.indices, graph.indptr), shape=graph.shape,
+                                                         copy=False))
+        else:
+            self.normalized_graphs = None
+
+    def _refresh_tables(self):
+        """
+        Recomputes the probability tables after the graphs or word counts changed, if they were precomputed.
+        :return: void
+        """
+        if self.row_sums is not None:
+            self.precompute_tables(self.normalized_graphs is not None)
+
+    @timed("update")
+    def update(self, text):
+        """
+        Appends text to the book and updates the trained model in place, as if make_book had been run on the combined
+        tokens (the appended text is not truncated). Only the new text is tokenized: new words are added to the end of
+        the vocabulary, the graphs grow to the new vocabulary size, and the counts of every (distance, previous word,
+        next word) triple whose next word is in the new text are added, including the windows that reach back across
+        the boundary into the old text. Only the cached normalizers of the graph rows that changed are invalidated.
+
+        Works on models loaded with load_compiled_model as well; the (read-only) memory-mapped arrays are replaced by
+        updated copies, not written to.
+        :param text: text to append
+        :return: number of tokens added
+        """
+        from scipy.sparse import coo_matrix, csr_matrix
+
+        new_tokens = self._parse(text)
+        if len(new_tokens) == 0:
+            return 0
+        old_vocabulary_size = self.vocabulary_size
+        index = self.vocab_to_matrix
+        words = self._words
+        new_ids = np.empty(len(new_tokens), dtype=np.int32)
+        for t, token in enumerate(new_tokens):
+            token_id = index.get(token)
+            if token_id is None:
+                token_id = index[token] = len(words)
+                words.append(token)
+            new_ids[t] = token_id
+        self.vocabulary_size = len(words)
+
+        # the last max_chain old tokens precede the new ones; new_ids[j] is preceded by sequence[len(tail) + j - d]
+        tail = self.token_ids[max(len(self.token_ids) - self.max_chain, 0):]
+        sequence = np.concatenate((tail, new_ids))
+        shape = (self.vocabulary_size, self.vocabulary_size)
+        changed_rows = {}  # distance index -> set of the previous words whose graph rows changed
+        graphs = []
+        for d in range(1, self.max_chain + 1):
+            first_child = max(len(tail), d)
+            parents = sequence[first_child - d:len(sequence) - d]
+            children = sequence[first_child:]
+            delta = coo_matrix((np.ones(len(parents), dtype=np.int32), (parents, children)), shape=shape).tocsr()
+            graph = self.graphs[d - 1]
+            if graph is None:
+                graph = delta
+            else:
+                # pad the graph to the new vocabulary size: the new rows are empty, so they all end where the last
+                # old row does
+                indptr = np.concatenate((graph.indptr, np.full(self.vocabulary_size - old_vocabulary_size,
+                                                               graph.indptr[-1], dtype=graph.indptr.dtype)))
+                graph = csr_matrix((graph.data, graph.indices, indptr), shape=shape) + delta
+            graph.sum_duplicates()
+            graphs.append(self._compact_counts(graph))
+            changed_rows[d - 1] = set(np.unique(parents).tolist())
+        self.graphs = graphs
+
+        word_counts = np.zeros(self.vocabulary_size, dtype=self.word_counts.dtype)
+        word_counts[:old_vocabulary_size] = self.word_counts
+        self.word_counts = word_counts + np.bincount(new_ids, minlength=self.vocabulary_size)
+        self.token_ids = np.concatenate((self.token_ids, new_ids))
+        self.num_words = len(self.token_ids)
+        self.book_text = self.book_text + "\n" + text if self.book_text else text
+        self._make_successor_index()
+        self._refresh_tables()
+
+        # normalizers are keyed by (distance index, previous word, suggested words); only those of changed rows are stale
+        invalidated = self.sum_w_d_p_list_s_cache.invalidate(lambda key: key[1] in changed_rows[key[0]])
+        self.instrumentation.count("update.invalidated_normalizers", invalidated)
+        return len(new_ids)
+
+    @timed("compress")
+    def compress(self, min_count=None, top_k=None, dtype=None):
+        """
+        Shrinks the bayesian graphs in place by dropping rare edges and/or narrowing the count dtype (see
+        api/compression.py). Each option is either one value for every distance or a sequence of max_chain values (None
+        leaves a distance alone). Pruning the graph for distance 1 also removes suggested words, since they are the
+        successors in that graph. update does not re-apply the compression.
+        :param min_count: drop edges with a count below min_count
+        :param top_k: keep the top_k largest counts of each row
+        :param dtype: unsigned dtype to store the counts as (e.g. "uint8"); larger counts saturate
+        :return: number of bytes saved
+        """
+        options = compression_module.compression_options(self.max_chain, min_count, top_k, dtype)
+        old_bytes = sum(compression_module.graph_nbytes(graph) for graph in self.graphs)
+        self.graphs = [compression_module.compress_graph(graph, options["min_count"][d], options["top_k"][d],
+                                                         options["dtype"][d])
+                       for d, graph in enumerate(self.graphs)]
+        self.compression = (self.compression or []) + [options]
+        self._make_successor_index()
+        self._refresh_tables()
+        self.sum_w_d_p_list_s_cache.clear()  # every normalizer may have changed
+        return old_bytes - sum(compression_module.graph_nbytes(graph) for graph in self.graphs)
+
+    @timed("save_compiled_model")
+    def save_compiled_model(self):
+        """
+        Writes the trained model (vocabulary, token indices and bayesian graphs) to self.path_to_model so that it can be
+        loaded with load_compiled_model instead of being rebuilt.
+        :return: void
+        """
+        model_store.save_model_state(model_store.model_state(self), model_store.model_meta(self), self.path_to_model)
+        print("Wrote compiled model for {} to {}".format(self.name_author, self.path_to_model))
+
+    @timed("load_compiled_model")
+    def load_compiled_model(self):
+        """
+        Memory-maps the trained model from self.path_to_model in place of running make_book.
+        :return: True if the model was loaded, False if there is no compiled model or it is stale (i.e. it was built
+         from a different text or with a different truncate or max_chain)
+        """
+        state = model_store.load_model_state(self.path_to_model, model_store.model_meta(self))
+        if state is None:
+            return False
+        model_store.apply_model_state(self, state)
+        print("Loaded compiled model for {}".format(self.name_author))
+        return True
 
     def _p_s(self, _s):
         """
         Returns P(s)
-        :param _s: word in book vocabulary
+        :param _s: word in book vocabulary (or its matrix index)
         :return: p(s) where p(s) = (number of occurances of s) / (number of words in book)
         """
-        return self.vocabulary[_s] / self.num_words
+        if self.prior is not None:
+            return self.prior[self._id_of(_s)].item()
+        return self.word_counts[self._id_of(_s)].item() / self.num_words
 
+    @timed("p_d_i_j")
     def _p_d_i_j(self, d, _p, _s, tuple_s):
         """
         Returns P^d(i, j)
+
+        Per-word version of what _cond_prob_segments computes for all suggested words at once; generation, scoring and
+        evaluation don't call it. Its normalizers are memoized in sum_w_d_p_list_s_cache, which bounds the memory this
+        API uses.
         :param d: distance
         :param _p: previous word
-        :param _j: suggested word
+        :param _s: suggested word
         :param tuple_s: tuple of all possible suggested words
         :return: (wight of graph d from _p to _s) / (sum of wights of graph d from _p to all list_s); if the denominator
          is 0, then return 0 to avoid dividing by 0
         """
         val_w_d_p_s = self.query_graph(d, _p, _s)
+        # callers pass the same tuple_s for every suggested word, so only convert it to indices when it changes
+        last_tuple_s, cand_ids, cand_key = self._last_candidates
+        if tuple_s is not last_tuple_s:
+            cand_ids = np.fromiter((self.vocab_to_matrix[_s_] for _s_ in tuple_s), dtype=np.int32, count=len(tuple_s))
+            cand_key = array_key(cand_ids)
+            self._last_candidates = (tuple_s, cand_ids, cand_key)
+        p_id = self.vocab_to_matrix[_p]
         # first, check caches for whether these values have already been queried
-        val_sum_w_d_p_list_s = self.sum_w_d_p_list_s_cache.get((d, _p, tuple_s))
+        cache_key = (d, p_id, cand_key)
+        val_sum_w_d_p_list_s = self.sum_w_d_p_list_s_cache.get(cache_key)
         if val_sum_w_d_p_list_s is None:
-            val_sum_w_d_p_list_s = 0
-            for _s_ in tuple_s: val_sum_w_d_p_list_s += self.query_graph(d, _p, _s_)
-            self.sum_w_d_p_list_s_cache[
-                (d, _p, tuple_s)] = val_sum_w_d_p_list_s  # store so that this calculation isn't redone
+            self.instrumentation.count("p_d_i_j.cache_misses")
+            if self.row_sums is not None and self.row_sums[d][p_id] == 0:  # no edges from _p at all
+                val_sum_w_d_p_list_s = 0.
+            else:
+                val_sum_w_d_p_list_s = self._graph_weights(d, p_id, cand_ids).sum()
+            self.sum_w_d_p_list_s_cache[cache_key] = val_sum_w_d_p_list_s  # store so that this calculation isn't redone
         if val_sum_w_d_p_list_s == 0:  # return 0 to avoid dividing by 0
             return 0
         else:
             return val_w_d_p_s / val_sum_w_d_p_list_s
 
+    def _graph_weights(self, d, p_id, cand_ids, graphs=None):
+        """
+        Vectorized equivalent of query_graph(d, _p, _s) for every _s in cand_ids: the row of graph d belonging to p_id
+        is scattered into a dense vector once, which cand_ids then index into.
+        :param d: distance
+        :param p_id: matrix index of the start node
+        :param cand_ids: array of matrix indices of the end nodes
+        :param graphs: list of graphs to read the edge values from (defaults to the count graphs)
+        :return: float array of edge values (0 where there is no edge)
+        """
+        graph = (self.graphs if graphs is None else graphs)[d]
+        start, end = graph.indptr[p_id], graph.indptr[p_id + 1]
+        dense_row = np.zeros(graph.shape[1])
+        dense_row[graph.indices[start:end]] = graph.data[start:end]
+        return dense_row[cand_ids]
+
+    def _cond_prob_segments(self, contexts, cand_ids, offsets):
+        """
+        Computes the conditional probabilities of the suggested words of several sequences at once. The suggested words
+        of sequence b are cand_ids[offsets[b]:offsets[b + 1]], and all of them are scored together: for each distance d,
+        the graph rows of the sequences' previous words are gathered, the normalizers (sum of w_d(p, s) over each
+        sequence's suggested words s) are computed with one bincount, and the log-likelihoods are accumulated as array
+        operations over all suggested words. The graph rows are looked up through row pointers gathered for all
+        sequences at once, and rows without edges are skipped. If the probability tables were precomputed (see
+        precompute_tables), the edge weights come from the row-normalized graphs (if any) and the smoothed log-prior is
+        gathered instead of computed.
+        :param contexts: (number of sequences x max_chain) array of the (ordered) matrix indices of the previous words;
+         -1 marks an unknown previous word, which contributes as a word without edges
+        :param cand_ids: array of the matrix indices of the suggested words of all sequences, concatenated
+        :param offsets: array of number of sequences + 1 offsets into cand_ids
+        :return: array of the same length as cand_ids with the conditional probabilities, which sum to 1 per sequence
+        """
+        num_sequences = len(contexts)
+        self.instrumentation.count("graph_row_lookups", contexts.size)
+        segments = np.repeat(np.arange(num_sequences), np.diff(offsets))  # sequence of each suggested word
+        log_sum_likelihood_arr = np.zeros(len(cand_ids))
+        weights = np.empty(len(cand_ids))
+        graphs = self.graphs if self.normalized_graphs is None else self.normalized_graphs
+        bounds = np.asarray(offsets).tolist()
+        dense_row = np.zeros(graphs[0].shape[1])  # see _graph_weights; cleared after each row instead of reallocated
+        for d in range(contexts.shape[1]):
+            graph = graphs[d]
+            p_ids = contexts[:, -1 - d]  # the previous word at distance d + 1 of each sequence
+            known = p_ids >= 0  # an unknown previous word (see score) has no edges
+            row_starts = np.where(known, graph.indptr[np.where(known, p_ids, 0)], 0)
+            row_ends = np.where(known, graph.indptr[np.where(known, p_ids, 0) + 1], 0)
+            for b, (start, end) in enumerate(zip(row_starts.tolist(), row_ends.tolist())):
+                cand_start, cand_end = bounds[b], bounds[b + 1]
+                if start == end:
+                    weights[cand_start:cand_end] = 0
+                else:
+                    row_indices = graph.indices[start:end]
+                    dense_row[row_indices] = graph.data[start:end]
+                    np.take(dense_row, cand_ids[cand_start:cand_end], out=weights[cand_start:cand_end])
+                    dense_row[row_indices] = 0
+            normalizers = np.bincount(segments, weights=weights, minlength=num_sequences)[segments]
+            p_d_arr = np.divide(weights, normalizers, out=np.zeros(len(cand_ids)), where=normalizers != 0)
+            log_sum_likelihood_arr += np.log(p_d_arr + self.alpha)  # TODO: divide by something for laplace smoothing?
+
+        if self.log_prior is not None:
+            log_prior_arr = self.log_prior[cand_ids]
+        else:
+            log_prior_arr = np.log(self.word_counts[cand_ids] / self.num_words + self.alpha)
+        cond_prob_arr = np.exp(log_prior_arr + log_sum_likelihood_arr)
+        # normalize so values sum to 1 per sequence
+        return cond_prob_arr / np.bincount(segments, weights=cond_prob_arr, minlength=num_sequences)[segments]
+
+    @timed("generate_cond_prob_arr")
     def generate_cond_prob_arr(self, tuple_s, list_p_forward):
         """
         :param tuple_s: list of unique suggested words (order is arbitrary but must be maintained so words can
          correspond to values in cond_prob_arr)
-        :param list_p_rev: (ordered) list of previous words preceding suggested word
+        :param list_p_forward: (ordered) list of previous words preceding suggested word
         :return: numpy array of length len(list_s_set) that contains the conditional probabilities
         """
-        cond_prob_arr = np.zeros((len(tuple_s)))
+        cand_ids = np.fromiter((self.vocab_to_matrix[_s] for _s in tuple_s), dtype=np.int32, count=len(tuple_s))
+        return self._cond_prob_arr(cand_ids, [self.vocab_to_matrix[_p] for _p in list_p_forward])
 
-        # calculate create an array that has the previous words in reverse order
-        list_p_rev = [list_p_forward[p] for p in range(len(list_p_forward) - 1, -1, -1)]
+    def _cond_prob_arr(self, cand_ids, list_p_forward_ids):
+        """
+        Same as generate_cond_prob_arr, but for matrix indices instead of words.
+        :param cand_ids: array of matrix indices of the suggested words
+        :param list_p_forward_ids: (ordered) matrix indices of the previous words preceding the suggested word
+        :return: numpy array of length len(cand_ids) that contains the conditional probabilities
+        """
+        return self._cond_prob_segments(np.array([list_p_forward_ids]), np.asarray(cand_ids), [0, len(cand_ids)])
+
+    def _target_log_probs(self, contexts, target_ids, chunk_size=256):
+        """
+        Computes the log of the conditional probability of each target word given its previous words, where the
+        suggested words the target competes with are all words that follow the most recent previous word in the text
+        plus the target itself (so a target that never followed that word still gets a probability, through alpha). As
+        in generation, all vocabulary words are suggested if the most recent previous word is unknown or has no
+        successors, but the suggested words are neither sampled down nor exclude the last two previous words.
+        :param contexts: (number of targets x max_chain) array of the (ordered) matrix indices of the previous words
+         (-1 for unknown words)
+        :param target_ids: array of the matrix indices of the target words
+        :param chunk_size: number of targets scored per call to _cond_prob_segments (bounds the memory used)
+        :return: float array of the natural log-probabilities of the targets
+        """
+        contexts = np.asarray(contexts, dtype=np.int32).reshape(-1, self.max_chain)
+        target_ids = np.asarray(target_ids, dtype=np.int32)
+        log_probs = np.empty(len(target_ids))
+        for start in range(0, len(target_ids), chunk_size):
+            chunk_contexts = contexts[start:start + chunk_size]
+            chunk_targets = target_ids[start:start + chunk_size]
+            last_ids = chunk_contexts[:, -1]
+            known = last_ids >= 0
+            successor_starts = np.where(known, self.successor_offsets[np.where(known, last_ids, 0)], 0)
+            successor_counts = np.where(known, self.successor_offsets[np.where(known, last_ids, 0) + 1] -
+                                        successor_starts, 0)
+            # fall back to all words, which are appended to the successor ids
+            fall_back = successor_counts == 0
+            successor_starts[fall_back] = len(self.successor_ids)
+            successor_counts[fall_back] = self.vocabulary_size
+            # gather the successors of every context's last word into one array, segment after segment
+            segments = np.repeat(np.arange(len(chunk_targets)), successor_counts)
+            segment_starts = np.concatenate(([0], np.cumsum(successor_counts)[:-1]))
+            pool = self.successor_ids
+            if fall_back.any():
+                pool = np.concatenate((pool, np.arange(self.vocabulary_size, dtype=np.int32)))
+            successors = pool[np.repeat(successor_starts - segment_starts, successor_counts) + np.arange(len(segments))]
+            # each segment is the target followed by the successors other than the target
+            not_target = successors != chunk_targets[segments]
+            counts = np.bincount(segments[not_target], minlength=len(chunk_targets)) + 1
+            offsets = np.concatenate(([0], np.cumsum(counts)))
+            cand_ids = np.empty(offsets[-1], dtype=np.int32)
+            is_target = np.zeros(offsets[-1], dtype=bool)
+            is_target[offsets[:-1]] = True
+            cand_ids[is_target] = chunk_targets
+            cand_ids[~is_target] = successors[not_target]
+            cond_prob_arr = self._cond_prob_segments(chunk_contexts, cand_ids, offsets)
+            log_probs[start:start + chunk_size] = np.log(cond_prob_arr[offsets[:-1]])
+        return log_probs
 
-        # iterate over the suggested words
-        for j, _s in enumerate(tuple_s):
-            prior_val = self._p_s(_s)
-            likelihood_arr = np.ones((len(list_p_rev))) * self.alpha  # initialize with alpha value
-            for i in range(len(list_p_rev)):
-                likelihood_arr[i] += self._p_d_i_j(i, list_p_rev[i], _s, tuple_s)
-            log_sum_likelihood_val = np.sum(np.log(likelihood_arr))  # TODO: divide by something for laplace smoothing?
-            cond_prob_arr[j] = np.exp(np.log(prior_val + self.alpha) + log_sum_likelihood_val)
+    def encode(self, tokens):
+        """
+        :param tokens: text (which is tokenized like the book, see _parse) or sequence of words
+        :return: (list of words, int32 array of their matrix indices with -1 for words not in the vocabulary) tuple
+        """
+        words = self._parse(tokens) if isinstance(tokens, str) else list(tokens)
+        vocab_to_matrix = self.vocab_to_matrix
+        return words, np.fromiter((vocab_to_matrix.get(word, -1) for word in words), dtype=np.int32, count=len(words))
 
-        return cond_prob_arr / np.sum(cond_prob_arr)  # normalize so values sum to 1
+    @timed("score")
+    def score(self, texts, oov_log_prob=None, window=4096):
+        """
+        Scores how likely the model finds each text: every token gets the log-probability the model (the same one
+        generate_cond_prob_arr computes) assigns to it given the max_chain tokens before it (see _target_log_probs).
+        The first tokens of a text have fewer previous words, and unknown previous words don't contribute. The tokens of
+        all texts are scored together in windows of up to window tokens, which may span several short texts or part of
+        a long one, so that many texts share vectorized calls while long texts are streamed.
+
+        Out-of-vocabulary tokens can't be scored: by default their log-probability is NaN and they are left out of the
+        perplexity, or, if oov_log_prob is given, they are assigned that log-probability and counted.
+        :param texts: text or list of texts, each a string or a sequence of words
+        :param oov_log_prob: log-probability assigned to out-of-vocabulary tokens, or None to skip them
+        :param window: maximum number of tokens scored at once
+        :return: for each text (or for the one text, if a string was given), a dictionary with the tokens, their
+         log_probs (float array), an oov mask, num_scored (number of tokens counted in the perplexity), the total
+         log_prob and the perplexity (exp of the negative mean log-probability; NaN if no token was counted)
+        """
+        single = isinstance(texts, str)
+        results = []
+        pending = []  # (log_probs array of a text, positions in it, contexts, target ids) waiting to be scored
+        num_pending = 0
 
-    def limit_s_to(self, length, list_s):
-        len_list_s = len(list_s)
-        if len_list_s > length:
-            random_idx = np.random.randint(0, len_list_s - length, length)
-            return list(np.array(list_s)[random_idx])
+        def flush():
+            log_probs = self._target_log_probs(np.concatenate([contexts for _, _, contexts, _ in pending]),
+                                               np.concatenate([targets for _, _, _, targets in pending]))
+            start = 0
+            for text_log_probs, positions, _, _ in pending:
+                text_log_probs[positions] = log_probs[start:start + len(positions)]
+                start += len(positions)
+            pending.clear()
+
+        for text in ([texts] if single else texts):
+            words, ids = self.encode(text)
+            # pad with unknown words so that every token has max_chain previous words
+            padded = np.concatenate((np.full(self.max_chain, -1, dtype=np.int32), ids))
+            contexts = np.lib.stride_tricks.sliding_window_view(padded, self.max_chain)[:len(ids)]
+            oov = ids < 0
+            log_probs = np.full(len(ids), np.nan if oov_log_prob is None else float(oov_log_prob))
+            known_positions = np.flatnonzero(~oov)
+            start = 0
+            while start < len(known_positions):  # split the text across windows
+                positions = known_positions[start:start + window - num_pending]
+                pending.append((log_probs, positions, contexts[positions], ids[positions]))
+                num_pending += len(positions)
+                start += len(positions)
+                if num_pending >= window:
+                    flush()
+                    num_pending = 0
+            results.append({"tokens": words, "log_probs": log_probs, "oov": oov})
+        if num_pending:
+            flush()
+
+        for result in results:
+            counted = result["log_probs"][~np.isnan(result["log_probs"])]
+            result["num_scored"] = len(counted)
+            result["log_prob"] = float(counted.sum())
+            result["perplexity"] = float(np.exp(-counted.mean())) if len(counted) else float("nan")
+        return results[0] if single else results
+
+    def limit_s_to(self, length, list_s, rng=None):
+        """
+        :return: a simple random sample (without replacement) of length items of list_s, or list_s if it isn't longer
+        """
+        if len(list_s) > length:
+            rng = self.rng if rng is None else rng
+            return [list_s[i] for i in rng.choice(len(list_s), size=length, replace=False)]
         else:
             return list_s
 
-    def apply_naive_bayes(self, extend_by=20):
-        starting_idx = np.random.randint(0, self.num_words - self.max_chain)
-        seed = self.tokens[starting_idx:self.max_chain + starting_idx]
-        actual_sentence = self.tokens[starting_idx:starting_idx + extend_by + self.max_chain]
-        generated_sentence = seed.copy()
+    def _candidate_ids(self, list_p_forward_ids, length, rng):
+        """
+        Returns the suggested words for the next word: all words that follow the most recent previous word in the text,
+        except that a word may not repeat either of the last two previous words (unless it is the only suggested word).
+        If there are more than length of these, a simple random sample of length of them is returned.
+        :param list_p_forward_ids: (ordered) matrix indices of the previous words
+        :param length: maximum number of suggested words
+        :param rng: numpy.random.Generator to sample with
+        :return: array of matrix indices of the suggested words
+        """
+        p_id = list_p_forward_ids[-1]
+        cand_ids = self.successor_ids[self.successor_offsets[p_id]:self.successor_offsets[p_id + 1]]
+        if len(cand_ids) == 0:  # the word only occurs at the very end of the text; anything may follow it
+            cand_ids = np.arange(self.vocabulary_size, dtype=np.int32)
+        for prev_id in list_p_forward_ids[-2:]:
+            if len(cand_ids) > 1:
+                cand_ids = cand_ids[cand_ids != prev_id]
+        if len(cand_ids) > length:
+            cand_ids = rng.choice(cand_ids, size=length, replace=False)
+        return cand_ids
+
+    @timed("generate_batch")
+    def generate_batch(self, seeds=None, n=None, extend_by=20, rng=None, as_words=False, max_suggested=1000,
+                       temperature=1., top_k=None, top_p=None):
+        """
+        Generates extend_by words for each of several sequences, advancing all of the sequences in lockstep so that
+        the suggested words of every sequence are scored in one vectorized step per position (see
+        _cond_prob_segments). Nothing is printed or plotted.
+        :param seeds: list of seed sequences (lists of words or arrays of matrix indices) with at least max_chain words
+         each, of which only the last max_chain words are used, or None to draw seeds from random positions in the text
+        :param n: if seeds is None, the number of sequences
+        :param extend_by: number of words to generate per sequence
+        :param rng: numpy.random.Generator to sample with (defaults to self.rng), or a list with one Generator per
+         sequence; a sequence with its own Generator generates the same words regardless of the other sequences in the
+         batch (and of extend_by, apart from its length); see sampling.sequence_rngs
+        :param as_words: return lists of words instead of an array of matrix indices
+        :param max_suggested: maximum number of suggested words per step (a random sample is taken if there are more)
+        :param temperature: sampling temperature (see api/sampling.py); 0 always picks the most likely word
+        :param top_k: only draw from the top_k most likely suggested words
+        :param top_p: only draw from the most likely suggested words whose cumulative probability reaches top_p
+        :return: (number of sequences x extend_by) int32 array of the matrix indices of the generated words, or a list
+         of lists of words if as_words
+        """
+        sampling.check_settings(temperature, top_k, top_p)
+        rng = self.rng if rng is None else rng
+        if seeds is None:
+            if n is None and not isinstance(rng, (list, tuple)):
+                raise ValueError("Either seeds, n or a list of Generators must be given")
+            seeds = [None] * (len(rng) if n is None else n)
+        rngs = list(rng) if isinstance(rng, (list, tuple)) else [rng] * len(seeds)
+        if len(rngs) != len(seeds):
+            raise ValueError("Got {} Generators for {} sequences".format(len(rngs), len(seeds)))
+        if len(seeds) == 0:
+            return [] if as_words else np.empty((0, extend_by), dtype=np.int32)
+        contexts = np.array([self._seed_ids(seed, seq_rng) for seed, seq_rng in zip(seeds, rngs)],
+                            dtype=np.int32).reshape(-1, self.max_chain)
+
+        generated = np.empty((len(contexts), extend_by), dtype=np.int32)
+        timer = self.instrumentation.timer
+        for i in range(extend_by):
+            with timer("generate_step.candidates"):
+                list_cand_ids = [self._candidate_ids(context, max_suggested, seq_rng)
+                                 for context, seq_rng in zip(contexts, rngs)]
+                offsets = np.concatenate(([0], np.cumsum([len(cand_ids) for cand_ids in list_cand_ids])))
+                cand_ids = np.concatenate(list_cand_ids)
+            with timer("generate_step.score"):
+                cond_prob_arr = self._cond_prob_segments(contexts, cand_ids, offsets)
+            with timer("generate_step.sample"):
+                uniforms = rng.random(len(contexts)) if rngs[0] is rng else np.array([r.random() for r in rngs])
+                generated[:, i] = cand_ids[sampling.sample_segments(cond_prob_arr, offsets, uniforms, temperature,
+                                                                    top_k, top_p)]
+            contexts[:, :-1] = contexts[:, 1:]  # slide the windows of previous words along by one
+            contexts[:, -1] = generated[:, i]
+        self.instrumentation.count("generate.words", generated.size)
+
+        if as_words:
+            return [[self.words[i] for i in sequence] for sequence in generated.tolist()]
+        return generated
+
+    def _seed_ids(self, seed, rng):
+        """
+        :param seed: sequence of at least max_chain words or matrix indices, or None to draw one from the text
+        :return: int32 array of the matrix indices of the last max_chain words of the seed
+        """
+        if seed is None:
+            starting_idx = rng.integers(0, self.num_words - self.max_chain)
+            return self.token_ids[starting_idx:starting_idx + self.max_chain].astype(np.int32)
+        if len(seed) < self.max_chain:
+            raise ValueError("Seeds must have at least max_chain ({}) words".format(self.max_chain))
+        seed = seed[len(seed) - self.max_chain:]
+        if isinstance(seed[0], str):
+            return np.array([self.vocab_to_matrix[_p] for _p in seed], dtype=np.int32)
+        return np.array(seed, dtype=np.int32)
+
+    def stream(self, seed=None, extend_by=None, rng=None, as_words=True, max_suggested=1000, stop_event=None,
+               temperature=1., top_k=None, top_p=None):
+        """
+        Generates words one at a time, yielding each as soon as it has been sampled. The previous max_chain words are
+        kept in a fixed-size ring buffer rather than re-sliced from the generated sequence at every step.
+
+        The stream can be cancelled by closing the generator (or simply no longer iterating over it), or by setting
+        stop_event from another thread.
+        :param seed: sequence of at least max_chain words or matrix indices; drawn from the text if None
+        :param extend_by: number of words to generate; unlimited if None
+        :param rng: numpy.random.Generator to sample with (defaults to self.rng)
+        :param as_words: yield words instead of matrix indices
+        :param max_suggested: maximum number of suggested words per step
+        :param stop_event: optional threading.Event (or any object with is_set()) that stops the stream when set
+        :param temperature: see generate_batch
+        :param top_k: see generate_batch
+        :param top_p: see generate_batch
+        :return: generator of words (or matrix indices)
+        """
+        sampling.check_settings(temperature, top_k, top_p)
+        rng = self.rng if rng is None else rng
+        ring = self._seed_ids(seed, rng)
+        head = 0  # position of the oldest previous word in ring
+        window = np.arange(self.max_chain)
+        timer = self.instrumentation.timer
+        context = np.empty((1, self.max_chain), dtype=np.int32)
         i = 0
-        while (i < extend_by):
-            list_p_forward = generated_sentence[len(generated_sentence) - self.max_chain:]  # ascending
-            # query all words that follow the most recent previous word in the text, and procure a simple random sample
-            # of these suggested words if there are more than 100
-            list_s = self.limit_s_to(1000, list(self.following_word[list_p_forward[-1]]))
-            for prev_word in list_p_forward[-2:]:
-                if list_s.__contains__(prev_word) and len(list_s) > 1: list_s.remove(prev_word)  # disallow a word to be
-                # repeated  within the last two previous words, while ensuring that there are a nonzero number of
-                # suggested words
-            cond_prob_arr = self.generate_cond_prob_arr(tuple(list_s), list_p_forward)
-            next_word = str(list_s[np.random.choice(np.array(range(0, len(list_s))), size=1, p=cond_prob_arr)[0]])
-            generated_sentence.append(next_word)
+        while (extend_by is None or i < extend_by) and not (stop_event is not None and stop_event.is_set()):
+            np.take(ring, (head + window) % self.max_chain, out=context[0])  # previous words in ascending order
+            with timer("generate_step.candidates"):
+                cand_ids = self._candidate_ids(context[0], max_suggested, rng)
+                offsets = [0, len(cand_ids)]
+            with timer("generate_step.score"):
+                cond_prob_arr = self._cond_prob_segments(context, cand_ids, offsets)
+            with timer("generate_step.sample"):
+                next_id = int(cand_ids[sampling.sample_segments(cond_prob_arr, offsets, rng.random(1), temperature,
+                                                                top_k, top_p)[0]])
+            self.instrumentation.count("generate.words")
+            ring[head] = next_id  # overwrite the oldest previous word
+            head = (head + 1) % self.max_chain
             i += 1
+            yield self.words[next_id] if as_words else next_id
+
+    async def astream(self, seed=None, extend_by=None, rng=None, as_words=True, max_suggested=1000, temperature=1.,
+                      top_k=None, top_p=None):
+        """
+        asyncio wrapper of stream: each word is generated in the event loop's default executor, so that several
+        streams can be served from one event loop without blocking it. Cancelling the consuming task (or closing the
+        async generator) stops the stream; a word still being generated in the executor is finished and discarded
+        first.
+        :return: async generator of words (or matrix indices)
+        """
+        import asyncio
+        import threading
+
+        loop = asyncio.get_running_loop()
+        stop_event = threading.Event()
+        words = self.stream(seed=seed, extend_by=extend_by, rng=rng, as_words=as_words, max_suggested=max_suggested,
+                            stop_event=stop_event, temperature=temperature, top_k=top_k, top_p=top_p)
+        done = object()
+        step_lock = threading.Lock()  # held by the executor thread while it advances words
+
+        def step():
+            with step_lock:
+                return next(words, done)
+
+        try:
+            while True:
+                word = await loop.run_in_executor(None, step)
+                if word is done:
+                    break
+                yield word
+        finally:
+            # cancelling the task doesn't interrupt a step already running in the executor, so stop the stream at its
+            # next check and wait for the step to return before closing the generator it is executing
+            stop_event.set()
+            if not step_lock.acquire(blocking=False):
+                await loop.run_in_executor(None, step_lock.acquire)
+            try:
+                words.close()
+            finally:
+                step_lock.release()
+
+    def apply_naive_bayes(self, extend_by=20, rng=None, show=True, save_path=None):
+        """
+        Generates extend_by words following a randomly chosen seed of max_chain words from the text, then prints and
+        plots the result against the actual text that followed the seed.
+        :param rng: numpy.random.Generator to sample with (defaults to self.rng)
+        :param show: show the plot (see analyze_result)
+        :param save_path: optional path to save the plot to
+        :return: void
+        """
+        rng = self.rng if rng is None else rng
+        starting_idx = rng.integers(0, self.num_words - self.max_chain)
+        seed_ids = self.token_ids[starting_idx:self.max_chain + starting_idx]
+        actual_ids = self.token_ids[starting_idx + self.max_chain:starting_idx + extend_by + self.max_chain]
+        generated_ids = self.generate_batch([seed_ids], extend_by=extend_by, rng=rng)[0]
 
-        print('--------\nSeed:\n"{}..."\nGenerated sentence:\n"{}"\nActual:\n"{}"\n'.format(" ".join(seed),
-            " ".join(generated_sentence), " ".join(actual_sentence)))
+        seed = " ".join(self.words[i] for i in seed_ids.tolist())
+        print('--------\nSeed:\n"{}..."\nGenerated sentence:\n"{} {}"\nActual:\n"{} {}"\n'.format(seed,
+            seed, " ".join(self.words[i] for i in generated_ids.tolist()),
+            seed, " ".join(self.words[i] for i in actual_ids.tolist())))
 
-        self.analyze_result(generated_sentence[self.max_chain:], actual_sentence[self.max_chain:])
+        self.analyze_result(generated_ids, actual_ids, show=show, save_path=save_path)
 
-    def analyze_result(self, post_seed_generated, post_seed_actual):
-        conjoined_vocab = list(set(post_seed_actual + post_seed_generated))
-        conjoined_vocab.sort(key=lambda x: -self.vocabulary[x])
-        conjoined_vocab_loc = {}
-        for i, vocab in enumerate(conjoined_vocab):
-            conjoined_vocab_loc[vocab] = i
-        len_conjoined_vocab = len(conjoined_vocab)
-        _generated_count = np.zeros(len_conjoined_vocab)
-        _actual_vocab_count= np.zeros(len_conjoined_vocab)
+    def _relative_frequencies(self, post_seed_generated, post_seed_actual):
+        """
+        :param post_seed_generated: generated words (or their matrix indices)
+        :param post_seed_actual: actual words (or their matrix indices)
+        :return: (matrix indices of the words occurring in either, sorted from most to least frequent in the whole text;
+         relative frequency of each of them in the generated words; the same in the actual words) tuple
+        """
+        generated_ids = np.array([self._id_of(word) for word in post_seed_generated], dtype=np.int32)
+        actual_ids = np.array([self._id_of(word) for word in post_seed_actual], dtype=np.int32)
+        conjoined_ids = np.union1d(generated_ids, actual_ids)
+        # stable, so ties stay in matrix index order
+        conjoined_ids = conjoined_ids[np.argsort(-self.word_counts[conjoined_ids], kind='stable')]
+        conjoined_vocab_loc = np.zeros(self.vocabulary_size, dtype=np.intp)
+        conjoined_vocab_loc[conjoined_ids] = np.arange(len(conjoined_ids))
+
+        generated_count = np.bincount(conjoined_vocab_loc[generated_ids], minlength=len(conjoined_ids)).astype(float)
+        actual_count = np.bincount(conjoined_vocab_loc[actual_ids], minlength=len(conjoined_ids)).astype(float)
+        return conjoined_ids, generated_count / generated_count.sum(), actual_count / actual_count.sum()
+
+    def frequency_distance(self, post_seed_generated, post_seed_actual):
+        """
+        Summarizes the comparison plotted by analyze_result in one number: the total variation distance between the
+        relative word frequencies of the generated and the actual text (0 if they use the same words equally often, 1 if
+        they share no words).
+        :return: float between 0 and 1
+        """
+        _, generated_frequencies, actual_frequencies = self._relative_frequencies(post_seed_generated, post_seed_actual)
+        return 0.5 * np.abs(generated_frequencies - actual_frequencies).sum()
 
-        for word in post_seed_generated:
-            _generated_count[conjoined_vocab_loc[word]] += 1
-        for word in post_seed_actual:
-            _actual_vocab_count[conjoined_vocab_loc[word]] += 1
+    def analyze_result(self, post_seed_generated, post_seed_actual, show=True, save_path=None):
+        """
+        Plots the relative frequency of each word in the generated and the actual text side by side. For evaluating
+        many samples without plotting, see api/evaluation.py.
+        :param post_seed_generated: generated words (or their matrix indices)
+        :param post_seed_actual: actual words (or their matrix indices)
+        :param show: show the plot (blocks until its window is closed with an interactive backend); the figure is
+         closed afterwards if False
+        :param save_path: optional path to save the plot to (e.g. a .png)
+        :return: void
+        """
+        import matplotlib.pyplot as plt
 
-        _generated_count /= np.sum(_generated_count)
-        _actual_vocab_count /= np.sum(_actual_vocab_count)
+        conjoined_ids, _generated_count, _actual_vocab_count = self._relative_frequencies(post_seed_generated,
+                                                                                          post_seed_actual)
+        conjoined_vocab = [self.words[i] for i in conjoined_ids.tolist()]
+        len_conjoined_vocab = len(conjoined_ids)
 
         x = np.arange(len_conjoined_vocab)  # the label locations
         width = 0.35  # the width of the bars
@@ -360,7 +1049,12 @@ class Book:
         fig.set_size_inches(15, 7)
         plt.xticks(rotation=90)
         ax.legend(loc='lower left', bbox_to_anchor=(0.0, 1.01), ncol=2, borderaxespad=0, frameon=False)
-        plt.show()
+        if save_path is not None:
+            fig.savefig(save_path, bbox_inches='tight')
+        if show:
+            plt.show()
+        else:
+            plt.close(fig)
 
     @staticmethod
     def autolabel(rects, ax):
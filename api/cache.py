@@ -0,0 +1,94 @@
+"""
+This stores the bounded cache used to memoize values computed by the book models.
+"""
+
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+
+def array_key(arr):
+    """
+    Returns a compact, hashable key for the contents of a numpy array: its length and the hash of its bytes (rather than
+    a tuple of all of its elements, which is as expensive to hash as the array is long).
+    :param arr: numpy array
+    :return: (length, hash) tuple
+    """
+    return len(arr), hash(np.ascontiguousarray(arr).tobytes())
+
+
+class LRUCache:
+    """
+    A dictionary-like cache holding at most maxsize entries; when it is full, the least recently used entry is evicted.
+    Hits, misses and evictions are counted so that the size of the cache can be tuned (see stats).
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        :return: the value stored under key (marking it as the most recently used), or default if there is none
+        """
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self, predicate):
+        """
+        Removes every entry whose key satisfies predicate (evictions are not counted).
+        :param predicate: function of a key returning True if the entry is stale
+        :return: number of entries removed
+        """
+        with self._lock:
+            stale_keys = [key for key in self._entries if predicate(key)]
+            for key in stale_keys:
+                del self._entries[key]
+        return len(stale_keys)
+
+    def clear(self):
+        """
+        Removes all entries (the counters are kept).
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        :return: dictionary with the hit, miss and eviction counts, the hit rate and the current and maximum size
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
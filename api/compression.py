@@ -0,0 +1,146 @@
+"""
+This stores the functions used for compressing the bayesian graphs of a trained book (see Book.compress) and for
+measuring what the compression costs.
+
+The graphs for far distances are close to uniform and consist mostly of count-1 edges, which add little to the
+likelihoods because alpha smooths them anyway. Three independent options trade accuracy for memory, each either one
+value for every distance or a sequence with one value per distance (None leaves that distance alone):
+    min_count   drop the edges with a count below min_count
+    top_k       keep only the top_k largest counts of each row (ties are broken by matrix index)
+    dtype       store the counts as this unsigned dtype (e.g. "uint8"), saturating counts that don't fit
+"""
+
+import copy
+
+import numpy as np
+
+from api.cache import LRUCache
+from api.evaluation import evaluate
+
+
+def graph_nbytes(graph):
+    """
+    :return: number of bytes held by the arrays of a CSR graph
+    """
+    return graph.data.nbytes + graph.indices.nbytes + graph.indptr.nbytes
+
+
+def per_distance(value, max_chain):
+    """
+    :param value: None, one value for every distance or a sequence of max_chain values
+    :return: list of max_chain values
+    """
+    if value is None or np.isscalar(value) or isinstance(value, (str, type, np.dtype)):
+        return [value] * max_chain
+    value = list(value)
+    if len(value) != max_chain:
+        raise ValueError("Expected one value per distance ({}), got {}".format(max_chain, len(value)))
+    return value
+
+
+def compression_options(max_chain, min_count=None, top_k=None, dtype=None):
+    """
+    :return: dictionary of the compression options as lists with one value per distance, with dtypes as their names
+     (JSON serializable, e.g. for the metadata of a compiled model)
+    """
+    return {
+        "min_count": [None if value is None else int(value) for value in per_distance(min_count, max_chain)],
+        "top_k": [None if value is None else int(value) for value in per_distance(top_k, max_chain)],
+        "dtype": [None if value is None else np.dtype(value).name for value in per_distance(dtype, max_chain)],
+    }
+
+
+def _filter_entries(graph, keep, rows):
+    """
+    :param keep: boolean array marking the entries of graph to keep
+    :param rows: row of each entry of graph
+    :return: csr_matrix with only the kept entries
+    """
+    from scipy.sparse import csr_matrix
+
+    indptr = np.zeros(graph.shape[0] + 1, dtype=graph.indptr.dtype)
+    np.cumsum(np.bincount(rows[keep], minlength=graph.shape[0]), out=indptr[1:])
+    return csr_matrix((graph.data[keep], graph.indices[keep], indptr), shape=graph.shape)
+
+
+def _entry_rows(graph):
+    return np.repeat(np.arange(graph.shape[0], dtype=np.int32), np.diff(graph.indptr))
+
+
+def prune_min_count(graph, min_count):
+    """
+    :return: copy of graph without the edges whose count is below min_count
+    """
+    return _filter_entries(graph, graph.data >= min_count, _entry_rows(graph))
+
+
+def keep_top_k(graph, top_k):
+    """
+    :return: copy of graph with only the top_k largest counts of each row (ties are broken by matrix index)
+    """
+    rows = _entry_rows(graph)
+    # order the entries by row, then by descending count, then by column; the rank of an entry is its position in the
+    # order relative to the start of its row
+    order = np.lexsort((graph.indices, -graph.data.astype(np.float64), rows))
+    rank = np.empty(graph.nnz, dtype=np.int64)
+    rank[order] = np.arange(graph.nnz) - graph.indptr[rows[order]]
+    return _filter_entries(graph, rank < top_k, rows)
+
+
+def saturate(graph, dtype):
+    """
+    :param dtype: unsigned integer dtype
+    :return: copy of graph with its counts stored as dtype, where counts above the largest value of dtype are clipped to
+     it
+    """
+    from scipy.sparse import csr_matrix
+
+    dtype = np.dtype(dtype)
+    if dtype.kind != "u":
+        raise ValueError("Counts can only be saturated to an unsigned integer dtype, not {}".format(dtype))
+    data = np.minimum(graph.data, np.iinfo(dtype).max).astype(dtype)
+    return csr_matrix((data, graph.indices, graph.indptr), shape=graph.shape)
+
+
+def compress_graph(graph, min_count=None, top_k=None, dtype=None):
+    """
+    Applies the compression options (see the module docstring) to one graph, in the order min_count, top_k, dtype.
+    :return: compressed copy of graph
+    """
+    if min_count is not None:
+        graph = prune_min_count(graph, min_count)
+    if top_k is not None:
+        graph = keep_top_k(graph, top_k)
+    if dtype is not None:
+        graph = saturate(graph, dtype)
+    return graph
+
+
+def compression_report(book, settings, num_samples=100, extend_by=20, seed=0):
+    """
+    Compresses copies of book with each of settings and reports the memory saved against the change in the
+    generated-vs-actual frequency metric (the mean frequency_distance of evaluation.evaluate, on the same samples for
+    every book; lower is better). The book itself is left unchanged.
+    :param book: trained Book object
+    :param settings: list of dictionaries of keyword arguments of Book.compress
+    :return: list of dictionaries, the first for the uncompressed book and then one per entry of settings
+    """
+    baseline_bytes = sum(graph_nbytes(graph) for graph in book.graphs)
+    baseline_distance = evaluate(book, num_samples, extend_by, seed, ngram_orders=())["frequency_distance"]["mean"]
+    report = [{"settings": None, "graph_bytes": baseline_bytes, "saved_bytes": 0, "saved_fraction": 0.,
+               "frequency_distance": baseline_distance, "frequency_distance_change": 0.}]
+    for options in settings:
+        compressed = copy.copy(book)
+        compressed.sum_w_d_p_list_s_cache = LRUCache(book.sum_w_d_p_list_s_cache.maxsize)
+        compressed.compress(**options)
+        graph_bytes = sum(graph_nbytes(graph) for graph in compressed.graphs)
+        distance = evaluate(compressed, num_samples, extend_by, seed, ngram_orders=())["frequency_distance"]["mean"]
+        report.append({
+            "settings": compressed.compression,
+            "graph_bytes": graph_bytes,
+            "saved_bytes": baseline_bytes - graph_bytes,
+            "saved_fraction": 1 - graph_bytes / baseline_bytes if baseline_bytes else 0.,
+            "frequency_distance": distance,
+            "frequency_distance_change": distance - baseline_distance,
+        })
+    return report
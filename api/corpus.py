@@ -0,0 +1,93 @@
+"""
+This stores the class used for training one model on several books at once.
+"""
+
+import numpy as np
+
+from api.book import Book
+from api.instrumentation import timed
+
+
+class Corpus(Book):
+    """
+    A corpus is a Book whose model is merged from several trained books: the books' vocabularies are interned into one
+    global vocabulary, and the bayesian graphs (and word counts) of the books are remapped onto it and summed, each
+    book optionally scaled by a weight. Everything that works on a Book (e.g. apply_naive_bayes) works on a corpus.
+    The corpus doesn't keep references to the books, so they can be freed once it is built.
+    """
+    __slots__ = ("book_names", "book_weights")
+
+    def __init__(self, books, weights=None, name_author="Corpus", alpha=None, instrumentation=None):
+        """
+        :param books: dictionary mapping name_author to trained Book objects; all books must have the same max_chain
+        :param weights: optional dictionary mapping name_author to the weight of that book's counts (default 1)
+        :param name_author: name of the corpus
+        :param alpha: smoothing value; defaults to the alpha of the first book
+        :param instrumentation: see Book
+        """
+        if len(books) == 0:
+            raise ValueError("A corpus needs at least one book")
+        max_chains = set(book.max_chain for book in books.values())
+        if len(max_chains) != 1:
+            raise ValueError("All books in a corpus must have the same max_chain (got {})".format(sorted(max_chains)))
+        first_book = next(iter(books.values()))
+        Book.__init__(self, name_author, {}, do_make_book=False, truncate=0., max_chain=first_book.max_chain,
+                      alpha=first_book.alpha if alpha is None else alpha, book_text="",
+                      instrumentation=instrumentation)
+
+        self.book_names = list(books)
+        self.book_weights = {name_author: 1 for name_author in books}
+        if weights is not None:
+            self.book_weights.update(weights)
+        self._make_corpus(books)
+
+    @timed("make_corpus")
+    def _make_corpus(self, books):
+        """
+        Builds the global vocabulary and merges the books' token indices, word counts and bayesian graphs into it.
+        :param books: dictionary mapping name_author to trained Book objects
+        :return: void
+        """
+        from scipy.sparse import coo_matrix
+
+        print('Building corpus from {} books'.format(len(books)))
+        index = {}  # global matrix index of each word
+        remaps = []  # for each book, the global index of each of the book's matrix indices
+        for book in books.values():
+            remaps.append(np.fromiter((index.setdefault(word, len(index)) for word in book.words), dtype=np.int32,
+                                      count=book.vocabulary_size))
+        self.vocabulary_size = len(index)
+        self.words = list(index.keys())
+
+        self.token_ids = np.concatenate([remap[book.token_ids] for remap, book in zip(remaps, books.values())])
+        self.num_words = len(self.token_ids)
+
+        weights = [self.book_weights[name_author] for name_author in books]
+        weighted_counts = np.zeros(self.vocabulary_size)
+        for remap, book, weight in zip(remaps, books.values(), weights):
+            weighted_counts[remap] += weight * book.word_counts  # remap is one-to-one
+        # scale the weighted counts so that they sum to the number of words and _p_s stays a probability
+        self.word_counts = weighted_counts * (self.num_words / weighted_counts.sum())
+        if all(weight == 1 for weight in weights):
+            self.word_counts = np.rint(self.word_counts).astype(int)
+
+        shape = (self.vocabulary_size, self.vocabulary_size)
+        dtype = int if all(float(weight).is_integer() for weight in weights) else float
+        self.graphs = []
+        for d in range(self.max_chain):
+            rows, cols, data = [], [], []
+            for remap, book, weight in zip(remaps, books.values(), weights):
+                graph = book.graphs[d].tocoo()
+                rows.append(remap[graph.row])
+                cols.append(remap[graph.col])
+                data.append(graph.data.astype(dtype) * weight)  # the books' counts may be stored as uint8
+            graph = coo_matrix((np.concatenate(data).astype(dtype), (np.concatenate(rows), np.concatenate(cols))),
+                               shape=shape).tocsr()
+            graph.sum_duplicates()
+            self.graphs.append(self._compact_counts(graph))  # integer counts in the smallest dtype, as in a Book
+
+        self._make_successor_index()
+        print('Finished building corpus ({} words, vocabulary of {})\n'.format(self.num_words, self.vocabulary_size))
+
+    def __str__(self):
+        return "Corpus: {}\nBooks: {}".format(self.name_author, ", ".join(self.book_names))
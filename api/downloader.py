@@ -0,0 +1,151 @@
+"""
+This stores the downloader that fetches book texts from a Project Gutenberg mirror.
+
+Downloads go through one shared, pooled requests.Session and are streamed to a ".part" file in chunks, so a book is
+never held in memory as a whole and an interrupted download is resumed with a Range request. Once complete, the Project
+Gutenberg header and footer are stripped in a second streaming pass, and the result is atomically renamed into place.
+"""
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+default_mirror_base_url = "http://mirrors.xmission.com/gutenberg/"
+default_chunk_size = 1 << 16  # bytes
+default_timeout = 30  # seconds
+
+# the line containing start_indicator ends the Project Gutenberg header, and the line starting with end_indicator begins
+# the footer
+start_indicator = "*** START OF"
+end_indicator = "*** END OF"
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class DownloadError(Exception):
+    """Raised when a book could not be downloaded from any of its links"""
+    pass
+
+
+def get_session():
+    """
+    :return: the requests.Session shared by all downloads, so that connections to the mirror are pooled and reused
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def book_links(book_number):
+    """
+    Generates the paths of a book's text relative to the mirror root, e.g. "1/2/3/1234/1234.txt" for book 1234. Some
+    books are only available in the UTF-8 "-0.txt" format, which is the second link.
+    :param book_number: ebook number as a string
+    :return: list of paths to try in order
+    """
+    directory = "/".join(list(book_number[:-1]) + [book_number])
+    return ["{}/{}.txt".format(directory, book_number), "{}/{}-0.txt".format(directory, book_number)]
+
+
+class Downloader:
+    def __init__(self, mirror_base_url=default_mirror_base_url, session=None, chunk_size=default_chunk_size,
+                 timeout=default_timeout):
+        """
+        :param mirror_base_url: root URL of the Project Gutenberg mirror (e.g. a local stand-in server for testing)
+        :param session: requests.Session to use; defaults to the shared session (see get_session)
+        :param chunk_size: number of bytes to read from the response at a time
+        :param timeout: connect/read timeout of each request in seconds
+        """
+        self.mirror_base_url = mirror_base_url if mirror_base_url.endswith("/") else mirror_base_url + "/"
+        self.session = session if session is not None else get_session()
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    def download_book(self, book_number, path):
+        """
+        Downloads the text of a book, strips the Project Gutenberg header and footer, and writes it (UTF-8) to path.
+        :param book_number: ebook number as a string
+        :param path: where to write the book text
+        :return: void
+        """
+        for link in book_links(book_number):
+            part_path = "{}.{}.part".format(path, os.path.basename(link))
+            if self._fetch(self.mirror_base_url + link, part_path):
+                break
+        else:
+            raise DownloadError("Could not download book {} from {}".format(book_number, self.mirror_base_url))
+        self._strip_markers(part_path, path)
+        os.remove(part_path)
+
+    def _fetch(self, url, part_path):
+        """
+        Streams url to part_path, resuming from the end of part_path if it already exists.
+        :return: True if part_path holds the complete file, False if there is no text at url (not found, or an html
+         page was served instead)
+        """
+        resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": "bytes={}-".format(resume_from)} if resume_from else {}
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 416:  # range not satisfiable: part_path is already complete
+                return True
+            if response.status_code == 404:
+                return False
+            response.raise_for_status()
+
+            chunks = response.iter_content(chunk_size=self.chunk_size)
+            if response.status_code == 206:
+                mode = "ab"
+            else:  # the server sent the whole file (it doesn't support ranges or this is the first attempt)
+                mode = "wb"
+                first_chunk = next(chunks, b"")
+                if first_chunk.lstrip()[:14].lower().startswith((b"<html", b"<!doctype html")):
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    return False
+                chunks = _prepend(first_chunk, chunks)
+
+            with open(part_path, mode) as part_file:
+                for chunk in chunks:
+                    part_file.write(chunk)
+        return True
+
+    @staticmethod
+    def _strip_markers(part_path, path):
+        """
+        Copies part_path to path line by line, leaving out everything up to and including the first line containing
+        start_indicator and everything from the line starting with end_indicator on (either may be missing). The text
+        is decoded as UTF-8, or as Latin-1 if it isn't valid UTF-8, and written as UTF-8 to a temporary file that is
+        then renamed to path.
+        """
+        tmp_path = "{}.tmp-{}".format(path, os.getpid())
+        for encoding in ("utf-8", "latin-1"):
+            try:
+                with open(part_path, "r", encoding=encoding) as part_file, \
+                        open(tmp_path, "w", encoding="utf-8") as tmp_file:
+                    found_start = False
+                    for line in part_file:
+                        if not found_start and start_indicator in line:
+                            found_start = True
+                            tmp_file.seek(0)  # drop the header written so far
+                            tmp_file.truncate()
+                        elif line.startswith(end_indicator):
+                            break
+                        else:
+                            tmp_file.write(line)
+                break
+            except UnicodeDecodeError:
+                continue
+        os.replace(tmp_path, path)
+
+
+def _prepend(first_chunk, chunks):
+    yield first_chunk
+    yield from chunks
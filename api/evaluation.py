@@ -0,0 +1,217 @@
+"""
+This stores the headless evaluation of a trained book: many seeded generations are compared against the spans of text
+that actually followed their seeds, with every metric computed over matrix indices with np.bincount/np.unique instead
+of per-word Python loops. Nothing is shown; a plot is only written to a file when a path is given.
+
+Metrics (per sample, then averaged):
+    frequency_distance  total variation distance between the relative word frequencies of the generated and the actual
+                        continuation (what Book.analyze_result plots; 0 is identical, 1 is disjoint)
+    perplexity          exp of the negative mean log-probability of the actual continuation under the model, each word
+                        given the max_chain actual words before it (see Book._target_log_probs); words the model never
+                        saw are left out, as in Book.score
+    ngram_overlap       for each n, the fraction of the generated n-grams that also occur in the actual continuation
+                        (counts clipped to the actual counts, as in BLEU)
+"""
+
+import numpy as np
+
+from api import sampling
+
+
+def sample_spans(num_words, span_length, num_samples, rng, valid=None):
+    """
+    :param valid: optional boolean array marking the start positions that may be drawn (one per start position, i.e.
+     num_words - span_length + 1 of them)
+    :return: array of num_samples random start positions of spans of span_length tokens in a text of num_words tokens
+    """
+    if num_words < span_length:
+        raise ValueError("The text ({} words) is shorter than a span ({} words)".format(num_words, span_length))
+    if valid is None:
+        return rng.integers(0, num_words - span_length + 1, size=num_samples)
+    valid_starts = np.flatnonzero(valid)
+    if len(valid_starts) == 0:
+        raise ValueError("No span of the text has a seed made of known words")
+    return valid_starts[rng.integers(0, len(valid_starts), size=num_samples)]
+
+
+def holdout_split(book, fraction):
+    """
+    Trains a model on all but the last fraction of the book's tokens, so that it can be evaluated on text it has never
+    seen. The model has the book's hyperparameters, compression and precomputed tables; its vocabulary only has the
+    words of the training part.
+    :param book: trained Book object
+    :param fraction: fraction of the tokens held out, between 0 and 1
+    :return: (Book trained on the first part of the tokens, int32 array of the matrix indices of the held-out tokens in
+     that book, with -1 for words it never saw) tuple
+    """
+    from api.book import Book
+
+    if not 0 < fraction < 1:
+        raise ValueError("The held-out fraction must be between 0 and 1, got {}".format(fraction))
+    split = book.num_words - round(book.num_words * fraction)
+    tokens = book.tokens
+    # the words are runs of letters and digits, so joining them with spaces tokenizes back into the same words
+    train_book = Book(book.name_author, {}, truncate=0, n=book.n, max_chain=book.max_chain, alpha=book.alpha,
+                      book_text=" ".join(tokens[:split]), instrumentation=book.instrumentation)
+    for options in book.compression or ():
+        train_book.compress(**options)
+    if book.row_sums is not None:
+        train_book.precompute_tables(book.normalized_graphs is not None)
+    _, heldout_ids = train_book.encode(tokens[split:])
+    return train_book, heldout_ids
+
+
+def frequency_distances(generated, actual):
+    """
+    Vectorized Book.frequency_distance for many samples at once.
+    :param generated: (number of samples x length) array of matrix indices of the generated words
+    :param actual: (number of samples x length) array of matrix indices of the actual words
+    :return: array of the total variation distance of each sample
+    """
+    num_samples, length = generated.shape
+    samples = np.repeat(np.arange(num_samples), length)
+    # one key per (sample, word), so that a single bincount counts the words of every sample
+    keys, inverse = np.unique(np.concatenate((np.stack((samples, generated.ravel()), axis=1),
+                                              np.stack((samples, actual.ravel()), axis=1))), axis=0,
+                              return_inverse=True)
+    inverse = inverse.ravel()
+    generated_counts = np.bincount(inverse[:generated.size], minlength=len(keys))
+    actual_counts = np.bincount(inverse[generated.size:], minlength=len(keys))
+    differences = np.abs(generated_counts - actual_counts) / length
+    return 0.5 * np.bincount(keys[:, 0], weights=differences, minlength=num_samples)
+
+
+def ngram_overlap(generated, actual, n):
+    """
+    :param generated: (number of samples x length) array of matrix indices of the generated words
+    :param actual: (number of samples x length) array of matrix indices of the actual words
+    :param n: n-gram order
+    :return: array of the clipped n-gram precision of each sample (NaN if length < n)
+    """
+    num_samples, length = generated.shape
+    num_ngrams = length - n + 1
+    if num_ngrams <= 0:
+        return np.full(num_samples, np.nan)
+    samples = np.repeat(np.arange(num_samples), num_ngrams)[:, None]
+
+    def ngrams(ids):  # rows of (sample, n matrix indices)
+        windows = np.lib.stride_tricks.sliding_window_view(ids, n, axis=1).reshape(-1, n)
+        return np.hstack((samples, windows))
+
+    keys, inverse = np.unique(np.vstack((ngrams(generated), ngrams(actual))), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    num_generated = num_samples * num_ngrams
+    matches = np.minimum(np.bincount(inverse[:num_generated], minlength=len(keys)),
+                         np.bincount(inverse[num_generated:], minlength=len(keys)))
+    return np.bincount(keys[:, 0], weights=matches, minlength=num_samples) / num_ngrams
+
+
+def evaluate(book, num_samples=100, extend_by=20, seed=0, token_ids=None, ngram_orders=(1, 2, 3), plot_path=None,
+             max_suggested=1000, per_sample=False, holdout=None, oov_log_prob=None):
+    """
+    Generates num_samples continuations of extend_by words in one batch (see Book.generate_batch), each from the
+    max_chain words before a random span of the text, and scores them against the span.
+
+    Spans whose seed contains a word the model never saw (-1 in token_ids) are not drawn. Such words in the actual
+    continuation can't be scored: by default they are left out of the perplexity, or, if oov_log_prob is given, they
+    are assigned that log-probability and counted (see Book.score). They never match a generated word.
+    :param book: trained Book object
+    :param num_samples: number of samples
+    :param extend_by: number of words generated (and compared) per sample
+    :param seed: seed of the span positions and the generation; the same seed gives the same report
+    :param token_ids: matrix indices of the text to draw the spans from, with -1 for unknown words (e.g. from
+     Book.encode); defaults to the book's own tokens
+    :param ngram_orders: n-gram orders of the ngram_overlap metric
+    :param plot_path: if given, write a plot of the word frequencies of all samples combined to this file
+    :param max_suggested: see Book.generate_batch
+    :param per_sample: also include the metrics of every sample
+    :param holdout: if given, the fraction of the book's tokens to hold out: a model is trained on the rest (see
+     holdout_split) and evaluated on the held-out tokens instead of book; token_ids must then be None
+    :param oov_log_prob: log-probability assigned to unknown words of the actual continuations, or None to skip them
+    :return: dictionary of metrics (see the module docstring)
+    """
+    if holdout is not None:
+        if token_ids is not None:
+            raise ValueError("token_ids can't be given together with holdout")
+        book, token_ids = holdout_split(book, holdout)
+    token_ids = book.token_ids if token_ids is None else np.asarray(token_ids, dtype=np.int32)
+    span_length = book.max_chain + extend_by
+    valid = None
+    oov = token_ids < 0
+    if oov.any() and len(token_ids) >= span_length:
+        # a span may start where none of the max_chain words of its seed are unknown
+        num_oov_before = np.concatenate(([0], np.cumsum(oov)))
+        num_starts = len(token_ids) - span_length + 1
+        valid = num_oov_before[book.max_chain:book.max_chain + num_starts] == num_oov_before[:num_starts]
+    starts = sample_spans(len(token_ids), span_length, num_samples, np.random.default_rng(seed), valid)
+    spans = token_ids[starts[:, None] + np.arange(span_length)]
+    seeds, actual = spans[:, :book.max_chain], spans[:, book.max_chain:]
+
+    generated = book.generate_batch(list(seeds), extend_by=extend_by, max_suggested=max_suggested,
+                                    rng=sampling.sequence_rngs(seed, num_samples))
+
+    # the context of the j-th actual word is the max_chain actual words before it (unknown ones don't contribute)
+    contexts = np.lib.stride_tricks.sliding_window_view(spans[:, :-1], book.max_chain, axis=1)
+    known = actual >= 0
+    log_probs = np.full(actual.shape, np.nan if oov_log_prob is None else float(oov_log_prob))
+    log_probs[known] = book._target_log_probs(contexts[known], actual[known])
+
+    distances = frequency_distances(generated, actual)
+    overlaps = {n: ngram_overlap(generated, actual, n) for n in ngram_orders}
+    counted = ~np.isnan(log_probs)
+    num_counted = counted.sum(axis=1)
+    sample_log_probs = np.divide(np.where(counted, log_probs, 0).sum(axis=1), num_counted,
+                                 out=np.full(num_samples, np.nan), where=num_counted != 0)
+    mean_log_prob = log_probs[counted].mean() if counted.any() else np.nan
+    report = {
+        "num_samples": num_samples,
+        "extend_by": extend_by,
+        "seed": seed,
+        "holdout": holdout,
+        "num_oov": int((~known).sum()),
+        "frequency_distance": {"mean": float(distances.mean()), "std": float(distances.std())},
+        "mean_log_prob": float(mean_log_prob),
+        "perplexity": float(np.exp(-mean_log_prob)),
+        "ngram_overlap": {str(n): float(np.nanmean(overlap)) if not np.isnan(overlap).all() else None
+                          for n, overlap in overlaps.items()},
+    }
+    if per_sample:
+        report["samples"] = [{"start": int(start), "frequency_distance": float(distances[i]),
+                              "perplexity": float(np.exp(-sample_log_probs[i])),
+                              "ngram_overlap": {str(n): float(overlap[i]) for n, overlap in overlaps.items()}}
+                             for i, start in enumerate(starts)]
+    if plot_path is not None:
+        plot_frequencies(book, generated, actual, plot_path)
+    return report
+
+
+def plot_frequencies(book, generated, actual, path, max_words=60):
+    """
+    Writes a bar plot of the relative frequencies of the generated and the actual words of all samples combined (the
+    plot of Book.analyze_result) to path, without using pyplot, so that no window is opened and the global matplotlib
+    state is left alone.
+    :param max_words: number of most frequent words shown
+    :return: void
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    actual = actual[actual >= 0]  # unknown words have no matrix index to plot
+    conjoined_ids, generated_frequencies, actual_frequencies = book._relative_frequencies(generated.ravel(), actual)
+    conjoined_ids = conjoined_ids[:max_words]
+    x = np.arange(len(conjoined_ids))
+    width = 0.35
+
+    fig = Figure(figsize=(15, 7))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.bar(x - width / 2, generated_frequencies[:max_words], width, label='Generated')
+    ax.bar(x + width / 2, actual_frequencies[:max_words], width, label='Actual')
+    ax.set_ylabel('Frequency')
+    ax.set_title('Frequency of generated vs. actual words over {} samples of {} words (sorted left-to-right from '
+                 'most to least frequent in the whole text body)'.format(*generated.shape))
+    ax.set_xticks(x)
+    ax.set_xticklabels([book.words[i] for i in conjoined_ids.tolist()], rotation=90)
+    ax.legend(loc='upper right')
+    fig.tight_layout()
+    fig.savefig(path)
@@ -0,0 +1,264 @@
+"""
+This stores the parser for Project Gutenberg's GUTINDEX.ALL catalogue and the sorted on-disk index built from it.
+
+The index is a directory holding:
+    records.txt          one "<title>, by <author>\t<ebook number>" line per book
+    offsets.npy          byte offset of each line in records.txt (plus the file length)
+    order_<field>.npy    record numbers sorted by the casefolded field, for field in ("name_author", "title", "author")
+Opening an index reads nothing; the files are memory-mapped on the first lookup, and each lookup is a binary search
+that only decodes the O(log n) records it compares against.
+"""
+
+import bisect
+import mmap
+import os
+import re
+import shutil
+import threading
+
+import numpy as np
+
+header_lines = 260  # number of lines at the top of GUTINDEX.ALL that precede the catalogue
+end_of_index = "<==End of GUTINDEX.ALL==>"
+fields = ("name_author", "title", "author")
+title_author_separator = ", by "
+
+# a catalogue entry: a line that doesn't start with whitespace or "~" and that ends with the ebook number; lines
+# starting with whitespace continue the previous entry (subtitles, contents, etc.) and are skipped
+_entry_re = re.compile(r"^(?P<name_author>[^\s~].*?)\s+(?P<number>\d+)\s*$", re.MULTILINE)
+
+
+def parse_entries(GUTINDEX_text):
+    """
+    Parses the catalogue entries of GUTINDEX.ALL in one pass with a compiled regex.
+    :param GUTINDEX_text: text of GUTINDEX.ALL
+    :return: generator of (name_author, ebook number) tuples of strings, in catalogue order
+    """
+    start = 0
+    for _ in range(header_lines):
+        start = GUTINDEX_text.find("\n", start) + 1
+        if start == 0:  # fewer lines than the header
+            return
+    end = GUTINDEX_text.find(end_of_index, start)
+    if end == -1:
+        end = len(GUTINDEX_text)
+    for match in _entry_re.finditer(GUTINDEX_text, start, end):
+        yield match.group("name_author").replace("\t", " "), match.group("number")
+
+
+def field_of(name_author, field):
+    """
+    :param name_author: "<title>, by <author>" (the author part may be missing)
+    :param field: one of "name_author", "title" or "author"
+    :return: the requested part of name_author
+    """
+    if field == "name_author":
+        return name_author
+    title, _, author = name_author.rpartition(title_author_separator)
+    if not title:  # no author
+        title, author = name_author, ""
+    return title if field == "title" else author
+
+
+class _SortedKeys:
+    """
+    Read-only sequence view of the casefolded keys of one field in sorted order, decoded on access, for bisect.
+    """
+
+    def __init__(self, index, field):
+        self.index = index
+        self.field = field
+        self.order = index._orders[field]
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, k):
+        return field_of(self.index._record(int(self.order[k]))[0], self.field).casefold()
+
+
+class GutenbergIndex:
+    """
+    Sorted, lazily loaded index of the Project Gutenberg catalogue supporting exact, prefix and case-insensitive lookup
+    by "<title>, by <author>", title or author. Also behaves like the {name_author: ebook number} dictionary it replaces
+    (get, [], in, len).
+    """
+
+    def __init__(self, path):
+        """
+        :param path: directory of an index written by GutenbergIndex.build
+        """
+        self.path = path
+        self._records = None
+        self._offsets = None
+        self._orders = None
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "order_author.npy"))  # written last by build
+
+    @classmethod
+    def build(cls, GUTINDEX_text, path):
+        """
+        Parses GUTINDEX_text and writes the index to the directory at path.
+        :return: GutenbergIndex object for the new index
+        """
+        entries = dict(parse_entries(GUTINDEX_text))  # later entries replace earlier ones with the same name_author
+        os.makedirs(path, exist_ok=True)
+        names = list(entries.keys())
+
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        with open(os.path.join(path, "records.txt"), "wb") as records_file:
+            for i, name_author in enumerate(names):
+                record = "{}\t{}\n".format(name_author, entries[name_author]).encode("utf-8")
+                offsets[i + 1] = offsets[i] + records_file.write(record)
+        np.save(os.path.join(path, "offsets.npy"), offsets)
+
+        for field in fields:
+            order = sorted(range(len(names)), key=lambda i: field_of(names[i], field).casefold())
+            np.save(os.path.join(path, "order_{}.npy".format(field)), np.array(order, dtype=np.int32))
+        return cls(path)
+
+    def _load(self):
+        if self._records is not None:
+            return
+        self._offsets = np.load(os.path.join(self.path, "offsets.npy"), mmap_mode='r')
+        self._orders = {field: np.load(os.path.join(self.path, "order_{}.npy".format(field)), mmap_mode='r')
+                        for field in fields}
+        with open(os.path.join(self.path, "records.txt"), "rb") as records_file:
+            # assigned last: other threads treat the index as loaded as soon as self._records is set
+            if os.fstat(records_file.fileno()).st_size == 0:
+                self._records = b""
+            else:
+                self._records = mmap.mmap(records_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _record(self, i):
+        """
+        :param i: record number
+        :return: (name_author, ebook number) tuple
+        """
+        line = self._records[self._offsets[i]:self._offsets[i + 1] - 1].decode("utf-8")
+        name_author, _, number = line.rpartition("\t")
+        return name_author, number
+
+    def lookup(self, query, field="name_author", prefix=False, case_sensitive=False):
+        """
+        Finds the books whose field equals (or, if prefix, starts with) query, in O(log n) comparisons.
+        :param query: string to look up
+        :param field: one of "name_author", "title" or "author"
+        :param prefix: match every entry whose field starts with query
+        :param case_sensitive: match case exactly (comparisons are otherwise casefolded)
+        :return: list of (name_author, ebook number) tuples sorted by field
+        """
+        if field not in fields:
+            raise ValueError("field must be one of {}".format(fields))
+        self._load()
+        keys = _SortedKeys(self, field)
+        key = query.casefold()
+        lo = bisect.bisect_left(keys, key)
+        hi = bisect.bisect_left(keys, key + "\U0010ffff", lo) if prefix else bisect.bisect_right(keys, key, lo)
+        matches = [self._record(int(i)) for i in keys.order[lo:hi]]
+        if case_sensitive:
+            matches = [(name_author, number) for name_author, number in matches
+                       if (str.startswith if prefix else str.__eq__)(field_of(name_author, field), query)]
+        return matches
+
+    def get(self, name_author, default=None):
+        """
+        :param name_author: exact "<title>, by <author>"
+        :return: ebook number of the book as a string, or default if it is not in the index
+        """
+        matches = self.lookup(name_author, case_sensitive=True)
+        return matches[0][1] if matches else default
+
+    def __getitem__(self, name_author):
+        number = self.get(name_author)
+        if number is None:
+            raise KeyError(name_author)
+        return number
+
+    def __contains__(self, name_author):
+        return self.get(name_author) is not None
+
+    def __len__(self):
+        self._load()
+        return len(self._offsets) - 1
+
+
+def open_index(path, GUTINDEX_text_path, rebuild=False,
+               GUTINDEX_url="https://www.gutenberg.org/dirs/GUTINDEX.ALL", timeout=60):
+    """
+    Opens the index at path (which reads nothing until the first lookup), building it first from the GUTINDEX.ALL
+    text at GUTINDEX_text_path, or downloading that text from GUTINDEX_url if it isn't there either.
+    :param rebuild: delete and rebuild an existing index
+    :param timeout: connect/read timeout of the download in seconds
+    :return: GutenbergIndex object, or None if GUTINDEX.ALL could not be downloaded
+    """
+    path_exists = GutenbergIndex.exists(path)
+    if path_exists and not rebuild:
+        print("{} index already exists".format(path))
+        return GutenbergIndex(path)
+    elif path_exists and rebuild:
+        print("Deleting old {} index".format(path))
+        shutil.rmtree(path)
+
+    if not os.path.exists(GUTINDEX_text_path):
+        import requests
+
+        # TODO: FIX reading of the gutenberg text file (weird characters show up for some reason)
+        print("Downloading the GUTINDEX file...")
+        try:
+            response = requests.get(GUTINDEX_url, timeout=timeout)
+            response.raise_for_status()  # don't parse an error page as the catalogue
+            GUTINDEX_text = response.text
+        except requests.exceptions.RequestException as e:
+            print("Invalid url / could not download from this link ({})".format(e))
+            return None
+        print("Finished downloading the GUTINDEX file")
+        GUTINDEX_file = open(GUTINDEX_text_path, "w")
+        GUTINDEX_file.write(GUTINDEX_text)
+        GUTINDEX_file.close()
+    else:
+        GUTINDEX_text_file = open(GUTINDEX_text_path, 'r')
+        GUTINDEX_text = GUTINDEX_text_file.read()
+        GUTINDEX_text_file.close()
+
+    print("Generating gutenberg index and writing it to {}".format(path))
+    return GutenbergIndex.build(GUTINDEX_text, path)
+
+
+class LazyIndex:
+    """
+    Stands in for the index opened by open_index and only opens it (building or downloading it if necessary) on the
+    first lookup, so that nothing is read or downloaded when every book is already cached. If the index can't be
+    opened, every lookup returns the default, i.e. the book is treated as not being in the index.
+    """
+
+    def __init__(self, path, GUTINDEX_text_path, rebuild=False):
+        """
+        :param path: see open_index
+        :param GUTINDEX_text_path: see open_index
+        :param rebuild: see open_index
+        """
+        self.path = path
+        self.GUTINDEX_text_path = GUTINDEX_text_path
+        self.rebuild = rebuild
+        self._index = None
+        self._opened = False
+        self._lock = threading.Lock()  # books may be fetched from several threads (see Librarian)
+
+    def open(self):
+        """
+        :return: GutenbergIndex object, or None if the index could not be opened (only attempted once)
+        """
+        with self._lock:
+            if not self._opened:
+                self._index = open_index(self.path, self.GUTINDEX_text_path, rebuild=self.rebuild)
+                self._opened = True
+                if self._index is None:
+                    print("Could not open the Gutenberg index")
+            return self._index
+
+    def get(self, name_author, default=None):
+        index = self.open()
+        return default if index is None else index.get(name_author, default)
@@ -0,0 +1,212 @@
+"""
+This stores the optional instrumentation layer: named timers and counters around the model building stages and the
+generation hot paths, plus an optional cProfile/tracemalloc capture.
+
+Every Book holds an Instrumentation object (the shared, disabled `disabled` by default). While an instrumentation is
+disabled, timed methods call straight through after checking one attribute, and timer() returns a shared no-op context
+manager, so leaving the hooks in costs next to nothing. A Librarian creates one enabled instrumentation for all of its
+books when it is constructed with instrument=True:
+
+    librarian = Librarian(book_list, instrument=True, profile=True)
+    with librarian.instrumentation.capture():  # also run cProfile/tracemalloc if enabled
+        book.generate_batch(n=10)
+    print(librarian.instrumentation_report())
+"""
+
+import functools
+import io
+import json
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class _Timer:
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.add_time(self.name, perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+class Instrumentation:
+    """
+    Accumulates named timers (call count, total and maximum duration) and counters, and optionally profiles (cProfile)
+    and traces memory allocations (tracemalloc) while capture() is active.
+    """
+
+    def __init__(self, enabled=True, profile=False, trace_memory=False, profile_top=25):
+        """
+        :param enabled: record timers and counters; when False, every hook is a no-op
+        :param profile: run cProfile while capture() is active
+        :param trace_memory: run tracemalloc while capture() is active
+        :param profile_top: number of functions (and allocation sites) listed in the report
+        """
+        self.enabled = enabled
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.profile_top = profile_top
+        self._timers = {}  # name -> [number of calls, total seconds, maximum seconds]
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._memory = None
+
+    def timer(self, name):
+        """
+        :param name: name of the timer, e.g. "generate_step.score"
+        :return: context manager adding the duration of its block to the timer
+        """
+        return _Timer(self, name) if self.enabled else _null_timer
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                self._timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def count(self, name, n=1):
+        """
+        Adds n to the counter name (no-op while disabled).
+        """
+        if self.enabled:
+            with self._lock:
+                self._counters[name] = self._counters.get(name, 0) + n
+
+    @contextmanager
+    def capture(self):
+        """
+        Context manager that runs cProfile and/or tracemalloc over its block (as set by profile and trace_memory); the
+        results of all captures are accumulated into the report.
+        """
+        if not self.enabled or not (self.profile or self.trace_memory):
+            yield self
+            return
+        import cProfile
+        import tracemalloc
+
+        started_tracemalloc = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        if self.profile:
+            if self._profiler is None:
+                self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        try:
+            yield self
+        finally:
+            if self.profile:
+                self._profiler.disable()
+            if self.trace_memory:
+                self._record_memory()
+                if started_tracemalloc:
+                    tracemalloc.stop()
+
+    def _record_memory(self):
+        import tracemalloc
+
+        peak = tracemalloc.get_traced_memory()[1]
+        top = tracemalloc.take_snapshot().statistics("lineno")[:self.profile_top]
+        previous_peak = self._memory["peak_bytes"] if self._memory is not None else 0
+        self._memory = {
+            "peak_bytes": max(peak, previous_peak),
+            "top_allocations": [{"location": str(stat.traceback[0]), "size_bytes": stat.size, "count": stat.count}
+                                for stat in top],
+        }
+
+    def _profile_report(self):
+        import pstats
+
+        stats = pstats.Stats(self._profiler, stream=io.StringIO())
+        stats.sort_stats("cumulative")
+        rows = []
+        for func in stats.fcn_list[:self.profile_top]:
+            primitive_calls, calls, total_time, cumulative_time, _ = stats.stats[func]
+            rows.append({"function": "{}:{}({})".format(*func), "calls": calls, "total_s": total_time,
+                         "cumulative_s": cumulative_time})
+        return rows
+
+    def report(self):
+        """
+        :return: dictionary with the timers (count, total_s, mean_s, max_s per name), the counters, and the profile and
+         memory captures if any were made
+        """
+        with self._lock:
+            report = {
+                "timers": {name: {"count": count, "total_s": total, "mean_s": total / count, "max_s": maximum}
+                           for name, (count, total, maximum) in sorted(self._timers.items())},
+                "counters": dict(sorted(self._counters.items())),
+            }
+        if self._profiler is not None:
+            report["profile"] = self._profile_report()
+        if self._memory is not None:
+            report["memory"] = self._memory
+        return report
+
+    def dump(self, path, **extra):
+        """
+        Writes the report (plus any extra keys) as JSON to path.
+        """
+        report = self.report()
+        report.update(extra)
+        with open(path, "w") as report_file:
+            json.dump(report, report_file, indent=1)
+
+    def reset(self):
+        """
+        Clears all timers, counters and captures.
+        """
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+            self._profiler = None
+            self._memory = None
+
+
+disabled = Instrumentation(enabled=False)
+
+
+def timed(name):
+    """
+    Decorator for methods of objects with an instrumentation attribute: times each call under name while the
+    instrumentation is enabled.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            instrumentation = self.instrumentation
+            if not instrumentation.enabled:
+                return method(self, *args, **kwargs)
+            start = perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                instrumentation.add_time(name, perf_counter() - start)
+        return wrapper
+    return decorator
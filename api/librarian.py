@@ -2,13 +2,27 @@
 This contains the functions that book.py and main.py reference
 """
 
-import requests
 import os
-from api.book import Book, InvalidBookError
-import pickle
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from api.book import Book, InvalidBookError, default_cache_dir
+from api.corpus import Corpus
+from api import model_store, gutindex
+from api.downloader import Downloader, default_mirror_base_url
+from api.compression import compression_options
+from api.instrumentation import Instrumentation, timed
 import sys
 
 
+def build_model_state(name_author, book_text, truncate, max_chain, compression=None):
+    """
+    Trains a book model from its text and returns the model's arrays (see model_store.model_state). Runs in the worker
+    processes of Librarian.check_library; the arrays pickle as flat buffers, so they are cheap to send back.
+    """
+    book = Book(name_author, {}, do_make_book=True, truncate=truncate, max_chain=max_chain, book_text=book_text,
+                compression=compression)
+    return model_store.model_state(book)
+
+
 class HelperFuncs:
     def __init__(self):
         pass
@@ -34,19 +48,17 @@ class HelperFuncs:
         if os.path.exists(folder):
             if delete_folder_if_exists: os.remove(folder)
         else:
-            os.system("mkdir {}".format(folder))
+            os.makedirs(folder, exist_ok=True)
 
 
 class Librarian(HelperFuncs):
     def __init__(self, book_list=(('Frankenstein', 'Mary Wollstonecraft (Godwin) Shelley')), redownload_index=False,
                  use_hardcoded=True, delete_existing_book_folder=False, delete_existing_cache=False,
-                 gutindex_info_path=os.path.join(os.getcwd(), "cache", "gutindex_info.bin"), global_truncate=0.4,
-                 global_alpha=1, global_max_chain=10):
+                 gutindex_info_path=None, global_truncate=0.4, global_alpha=1, global_max_chain=10,
+                 use_compiled_models=True, num_workers=1,
+                 mirror_base_url=default_mirror_base_url, instrument=False, profile=False, trace_memory=False,
+                 global_compression=None, precompute=None, cache_dir=default_cache_dir):
         HelperFuncs.__init__(self)
-        # Hard coding conditions that the text parser will use:
-        self.skip_line_if = [" ", "~", "TITLE"]
-        self.end_title_if = ["  ", " 1", " 2", " 3", " 4", " 5", " 6", " 7", " 8", " 9"]
-
         self.redownload_index = redownload_index
         self.use_hardcoded = use_hardcoded
         self.delete_existing_book_folder = delete_existing_book_folder
@@ -54,18 +66,34 @@ class Librarian(HelperFuncs):
         self.book_list = [", by ".join(book) for book in book_list]
         self.num_books_requested = len(self.book_list)
         self.num_books_acquired = 0
-        self.gutindex_info_path = gutindex_info_path
+        # the index, book texts and compiled models are all stored under cache_dir
+        self.cache_dir = cache_dir
+        self.gutindex_info_path = os.path.join(self.cache_dir, "gutindex") if gutindex_info_path is None \
+            else gutindex_info_path
 
         # hyperparameters to pass on to all book objects
         self.global_truncate = global_truncate
         self.global_alpha = global_alpha
         self.global_max_chain = global_max_chain
+        self.global_compression = global_compression  # keyword arguments of Book.compress, e.g. {"min_count": 2}
+        # None, "tables" or "normalized": precompute every book's probability tables, optionally with row-normalized
+        # graphs (see Book.precompute_tables)
+        self.precompute = precompute
+        self.use_compiled_models = use_compiled_models
+        self.num_workers = num_workers  # books are acquired and built in parallel if > 1
+        self.downloader = Downloader(mirror_base_url)  # shared by all books
+        # timers and counters of this librarian and all of its books; can also be switched on or off later by setting
+        # self.instrumentation.enabled (see instrumentation_report)
+        self.instrumentation = Instrumentation(enabled=instrument, profile=profile, trace_memory=trace_memory)
 
         self.acquired_books = {}
+        self.failed_books = {}  # name_author -> description of why the book could not be acquired or built
+        self.corpus = None
         self.gutenberg_index_dict = {}
 
-        self.check_folder_exist("cache/", delete_folder_if_exists=self.delete_existing_cache)
-        self.check_folder_exist("cache/books/", delete_folder_if_exists=self.delete_existing_book_folder)
+        self.check_folder_exist(self.cache_dir, delete_folder_if_exists=self.delete_existing_cache)
+        self.check_folder_exist(os.path.join(self.cache_dir, "books"),
+                                delete_folder_if_exists=self.delete_existing_book_folder)
 
         succ1 = self.check_GUTINDEX(self.gutindex_info_path)
 
@@ -75,98 +103,165 @@ class Librarian(HelperFuncs):
 
         self.check_library()
 
-    def parse_GUTINDEX_text(self, GUTINDEX_text):
-        gutenberg_index_dict = {}
-        gut_lines = GUTINDEX_text.split("\n")
-        for line in gut_lines[260:]:
-            if line == "<==End of GUTINDEX.ALL==>":
-                break
-            else:
-                if len(line) != 0:  # Skip empty lines
-                    if line[0] not in self.skip_line_if or line[0:5] not in self.skip_line_if:
-                        # At this point, the line in consideration will have a book title/author name and index number
-                        for i in range(len(line) - 1):
-                            if line[i:i + 2] in self.end_title_if:
-                                # Find where the book title ends in the line
-                                book_name_author = line[0:i]
-                                for j in range(0, len(line)):
-                                    if line[len(line) - j - 1] == " ":
-                                        # Pull out the index number of the book
-                                        book_number = line[len(line) - j:len(line)]
-                                        break
-                                try:
-                                    float(book_number)
-                                except ValueError:
-                                    break  # error acquiring the book number
-                                gutenberg_index_dict[book_name_author] = book_number
-                                break
-        return gutenberg_index_dict
-
-    def check_GUTINDEX(self, gutindex_info_path, GUTINDEX_text_path=os.path.join(os.getcwd(), "cache", "GUTINDEX.txt")):
+    @staticmethod
+    def parse_GUTINDEX_text(GUTINDEX_text):
         """
-        Handles the GUTINDEX.txt file - either download it for the first time or
-        redownloads the file.
-        """
-        path_exists = os.path.exists(gutindex_info_path)
-        if path_exists and not self.redownload_index:
-            print("{} file already exists".format(gutindex_info_path))
-            # Load the gutenberg_index dictionary
-            gutenberg_index_file = open(self.gutindex_info_path, "rb")
-            self.gutenberg_index_dict = pickle.loads(gutenberg_index_file.read())
-            gutenberg_index_file.close()
-            return True
-        elif path_exists and self.redownload_index:
-            print("Deleting old {} file".format(gutindex_info_path))
-            os.remove(gutindex_info_path)
-
-        if not os.path.exists(GUTINDEX_text_path):
-            # TODO: FIX reading of the gutenberg text file (weird characters show up for some reason)
-            print("Downloading the GUTINDEX file...")
-            try:
-                GUTINDEX_text = requests.get("https://www.gutenberg.org/dirs/GUTINDEX.ALL").text
-            except requests.exceptions.MissingSchema:
-                print("Invalid url / could not download from this link")
-                return False
-            print("Finished downloading the GUTINDEX file")
-            GUTINDEX_file = open(GUTINDEX_text_path, "w")
-            GUTINDEX_file.write(GUTINDEX_text)
-            GUTINDEX_file.close()
-        else:
-            GUTINDEX_text_file = open(GUTINDEX_text_path, 'r')
-            GUTINDEX_text = GUTINDEX_text_file.read()
-            GUTINDEX_text_file.close()
-
-        print("Generating gutenberg_index dictionary and writing as {}".format(gutindex_info_path))
-        gutenberg_index_dict = self.parse_GUTINDEX_text(GUTINDEX_text)
-        self.gutenberg_index_dict = gutenberg_index_dict
+        :param GUTINDEX_text: text of GUTINDEX.ALL
+        :return: dictionary mapping "<title>, by <author>" to the book's ebook number (see gutindex.parse_entries)
+        """
+        return dict(gutindex.parse_entries(GUTINDEX_text))
 
-        GUTINDEX_file = open(gutindex_info_path, "wb")
-        GUTINDEX_file.write(pickle.dumps(gutenberg_index_dict))
-        GUTINDEX_file.close()
+    def check_GUTINDEX(self, gutindex_info_path, GUTINDEX_text_path=None):
+        """
+        Handles the GUTINDEX.txt file - either download it for the first time or
+        redownloads the file - and the sorted index built from it (see gutindex.open_index). Unless the index is to be
+        redownloaded, it is opened lazily (see gutindex.LazyIndex): only when a book that isn't cached is looked up.
+        :param GUTINDEX_text_path: defaults to GUTINDEX.txt in self.cache_dir
+        :return: False if the index was to be redownloaded and that failed
+        """
+        if GUTINDEX_text_path is None:
+            GUTINDEX_text_path = os.path.join(self.cache_dir, "GUTINDEX.txt")
+        index = gutindex.LazyIndex(gutindex_info_path, GUTINDEX_text_path, rebuild=self.redownload_index)
+        if self.redownload_index and index.open() is None:
+            return False
+        self.gutenberg_index_dict = index
         return True
 
     def check_library(self, reset_library=True):
         """
         This function will prompt the user to either download books from the hard-coded list or to type in the desired
         books by hand. The program will then acquire the books if they haven't already, or if they have, loading them into
-        book objects in the library dictionary.
-        :param gutenberg_index_dict:
-        :param num_texts_plot: either take input of one or two texts
-        :return library: a dictionary of the book objects
-        """
-        if reset_library: self.acquired_books = {}  # reset library dictionary
-        for b, book_name_author in enumerate(self.book_list):
-            print("Loading {}".format(book_name_author))
-            try:
-                self.acquired_books[book_name_author] = Book(book_name_author, self.gutenberg_index_dict,
-                                                             truncate=self.global_truncate, alpha=self.global_alpha,
-                                                             max_chain=self.global_max_chain)
-            except InvalidBookError:
-                print("Unable to acquire {} (InvalidBookError raised)")
-                if b != self.num_books_requested - 1:
-                    print("Will try to acquire the next book...")
+        book objects in the library dictionary. Books that cannot be acquired are recorded in self.failed_books.
+        :param reset_library: clear self.acquired_books and self.failed_books first
+        :return: void
+        """
+        if reset_library:  # reset library dictionary
+            self.acquired_books = {}
+            self.failed_books = {}
+        with self.instrumentation.capture(), self.instrumentation.timer("librarian.check_library"):
+            self._check_library()
+            if self.precompute is not None:
+                for book in self.acquired_books.values():
+                    book.precompute_tables(normalize_graphs=self.precompute == "normalized")
         self.num_books_acquired = len(self.acquired_books)
 
+    def _check_library(self):
+        if self.num_workers > 1:
+            self._check_library_parallel()
+        else:
+            for b, book_name_author in enumerate(self.book_list):
+                print("Loading {}".format(book_name_author))
+                try:
+                    self.acquired_books[book_name_author] = Book(book_name_author, self.gutenberg_index_dict,
+                                                                 truncate=self.global_truncate,
+                                                                 alpha=self.global_alpha,
+                                                                 max_chain=self.global_max_chain,
+                                                                 use_compiled_model=self.use_compiled_models,
+                                                                 downloader=self.downloader,
+                                                                 instrumentation=self.instrumentation,
+                                                                 compression=self.global_compression,
+                                                                 cache_dir=self.cache_dir)
+                except InvalidBookError:
+                    print("Unable to acquire {} (InvalidBookError raised)".format(book_name_author))
+                    self.failed_books[book_name_author] = "InvalidBookError"
+                    if b != self.num_books_requested - 1:
+                        print("Will try to acquire the next book...")
+
+    @timed("librarian.fetch_book")
+    def _fetch_book(self, book_name_author):
+        """
+        Reads the cached text of a book (downloading it if necessary) without building its model.
+        :return: Book object on which make_book has not been run
+        """
+        print("Loading {}".format(book_name_author))
+        book = Book(book_name_author, self.gutenberg_index_dict, do_make_book=False, truncate=self.global_truncate,
+                    alpha=self.global_alpha, max_chain=self.global_max_chain, downloader=self.downloader,
+                    instrumentation=self.instrumentation, cache_dir=self.cache_dir)
+        if self.global_compression is not None:  # so that the compiled model is checked and saved as compressed
+            book.compression = [compression_options(book.max_chain, **self.global_compression)]
+        return book
+
+    def _check_library_parallel(self):
+        """
+        Parallel version of check_library: the book texts are downloaded/read by a pool of self.num_workers threads
+        (I/O-bound), and the models of books that don't have a valid compiled model are built by a pool of
+        self.num_workers processes (CPU-bound). A failure of one book is recorded in self.failed_books and doesn't stop
+        the others.
+        :return: void
+        """
+        fetched_books = {}
+        with ThreadPoolExecutor(max_workers=self.num_workers) as thread_pool:
+            futures = {thread_pool.submit(self._fetch_book, book_name_author): book_name_author
+                       for book_name_author in self.book_list}
+            for future in as_completed(futures):
+                book_name_author = futures[future]
+                try:
+                    fetched_books[book_name_author] = future.result()
+                except InvalidBookError:
+                    print("Unable to acquire {} (InvalidBookError raised)".format(book_name_author))
+                    self.failed_books[book_name_author] = "InvalidBookError"
+                except Exception as e:  # e.g. a cached text that isn't valid UTF-8
+                    print("Unable to acquire {} ({} raised)".format(book_name_author, type(e).__name__))
+                    self.failed_books[book_name_author] = "{}: {}".format(type(e).__name__, e)
+
+        built_books = {}
+        books_to_build = []
+        for book_name_author, book in fetched_books.items():
+            try:
+                loaded = self.use_compiled_models and book.load_compiled_model()
+            except Exception as e:  # a corrupt compiled model
+                print("Unable to load {} ({} raised)".format(book_name_author, type(e).__name__))
+                self.failed_books[book_name_author] = "{}: {}".format(type(e).__name__, e)
+                continue
+            if loaded:
+                built_books[book_name_author] = book
+            else:
+                books_to_build.append(book)
+
+        if len(books_to_build) != 0:
+            num_processes = min(self.num_workers, len(books_to_build))
+            with self.instrumentation.timer("librarian.build_books"), \
+                    ProcessPoolExecutor(max_workers=num_processes) as process_pool:
+                futures = {process_pool.submit(build_model_state, book.name_author, book.book_text, book.truncate,
+                                               book.max_chain, self.global_compression): book
+                           for book in books_to_build}
+                for future in as_completed(futures):
+                    book = futures[future]
+                    try:
+                        model_store.apply_model_state(book, future.result())
+                    except Exception as e:
+                        print("Unable to build {} ({} raised)".format(book.name_author, type(e).__name__))
+                        self.failed_books[book.name_author] = "{}: {}".format(type(e).__name__, e)
+                        continue
+                    if self.use_compiled_models:
+                        book.save_compiled_model()
+                    built_books[book.name_author] = book
+
+        for book_name_author in self.book_list:  # add the books in the order of self.book_list
+            if book_name_author in built_books:
+                self.acquired_books[book_name_author] = built_books[book_name_author]
+
+    def build_corpus(self, weights=None, release_books=False):
+        """
+        Merges all of the acquired books into one model with a shared vocabulary (see Corpus), stored as self.corpus.
+        :param weights: optional dictionary mapping name_author to the weight of that book (default 1)
+        :param release_books: clear self.acquired_books afterwards, so that only the corpus is kept in memory
+        :return: the Corpus object
+        """
+        self.corpus = Corpus(self.acquired_books, weights=weights, alpha=self.global_alpha,
+                             instrumentation=self.instrumentation)
+        if release_books:
+            self.acquired_books = {}
+        if self.precompute is not None:
+            self.corpus.precompute_tables(normalize_graphs=self.precompute == "normalized")
+        return self.corpus
+
+    def instrumentation_report(self):
+        """
+        :return: self.instrumentation.report()
+        """
+        return self.instrumentation.report()
+
 
 if __name__ == "__main__":
     # TODO: implement unit tests
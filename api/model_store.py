@@ -0,0 +1,164 @@
+"""
+This stores the functions used for saving trained book models to disk and loading them back.
+
+A compiled model is a directory next to the cached book text (<cache_dir>/books/<name_author>.model/, see Book) that
+holds one .npy file per array, so that every array can be memory-mapped on load and the pages shared between processes:
+    meta.json                               parameters the model was built with (see model_meta)
+    words.npy                               vocabulary words in matrix index order
+    token_ids.npy                           the book's tokens as matrix indices
+    graph_<d>_{indptr,indices,data}.npy     CSR arrays of the bayesian graph for distance d + 1
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+# bump whenever the layout of a compiled model changes so that old models get rebuilt
+model_format_version = 2
+graph_array_names = ("indptr", "indices", "data")
+
+
+class _MappedGraph:
+    """
+    Read-only CSR graph of a loaded model, held as its (memory-mapped) arrays. Generation only reads the arrays, so
+    the scipy csr_matrix (and scipy itself) is only built on the first use of anything else, e.g. indexing or tocoo.
+    """
+    __slots__ = ("indptr", "indices", "data", "shape", "_csr")
+
+    def __init__(self, indptr, indices, data, shape):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = shape
+        self._csr = None
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def tocsr(self):
+        """
+        :return: csr_matrix sharing the arrays of the graph
+        """
+        if self._csr is None:
+            from scipy.sparse import csr_matrix
+            self._csr = csr_matrix((self.data, self.indices, self.indptr), shape=self.shape, copy=False)
+        return self._csr
+
+    def __getitem__(self, key):
+        return self.tocsr()[key]
+
+    def __getattr__(self, name):  # everything else behaves like the csr_matrix
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.tocsr(), name)
+
+
+def compiled_model_path(path_to_book):
+    """
+    :param path_to_book: path of the cached book text
+    :return: path of the directory holding the book's compiled model
+    """
+    return os.path.splitext(path_to_book)[0] + ".model"
+
+
+def model_meta(book):
+    """
+    Returns the parameters that a compiled model depends on; a model on disk is only valid for a book whose metadata
+    is identical.
+    :param book: Book object
+    :return: dictionary of metadata
+    """
+    return {
+        "format_version": model_format_version,
+        "truncate": book.truncate,
+        "max_chain": book.max_chain,
+        "text_sha1": hashlib.sha1(book.book_text.encode("utf-8")).hexdigest(),
+        "compression": book.compression,
+    }
+
+
+def model_state(book):
+    """
+    Collects the arrays that make up a trained book model.
+    :param book: Book object on which make_book has been run
+    :return: dictionary mapping array names to numpy arrays
+    """
+    state = {
+        "words": np.array(book.words),
+        "token_ids": book.token_ids,
+    }
+    for d, graph in enumerate(book.graphs):
+        for name in graph_array_names:
+            state["graph_{}_{}".format(d, name)] = getattr(graph, name)
+    return state
+
+
+def apply_model_state(book, state):
+    """
+    Restores a trained book model from the arrays returned by model_state (or load_model_state), which replaces
+    running make_book.
+    :param book: Book object
+    :param state: dictionary mapping array names to numpy arrays
+    :return: void
+    """
+    book.words = state["words"].tolist()
+    book.vocabulary_size = len(book.words)
+    book.token_ids = state["token_ids"]
+    book.num_words = len(book.token_ids)
+    book.word_counts = np.bincount(book.token_ids, minlength=book.vocabulary_size)
+
+    shape = (book.vocabulary_size, book.vocabulary_size)
+    book.graphs = []
+    for d in range(book.max_chain):
+        indptr, indices, data = (state["graph_{}_{}".format(d, name)] for name in graph_array_names)
+        book.graphs.append(_MappedGraph(indptr, indices, data, shape))
+    book._make_successor_index()
+    book._refresh_tables()
+
+
+def save_model_state(state, meta, path):
+    """
+    Writes a compiled model to the directory at path, replacing any existing one. The model is written to a temporary
+    directory first so that readers never see a partially written model.
+    :param state: dictionary mapping array names to numpy arrays
+    :param meta: dictionary of metadata (see model_meta)
+    :return: void
+    """
+    tmp_path = "{}.tmp-{}".format(path, os.getpid())
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for name, arr in state.items():
+        np.save(os.path.join(tmp_path, name + ".npy"), arr)
+    with open(os.path.join(tmp_path, "meta.json"), "w") as meta_file:
+        json.dump(meta, meta_file)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+
+def load_model_state(path, meta):
+    """
+    Memory-maps the arrays of the compiled model at path.
+    :param meta: metadata of the book the model is being loaded for (see model_meta)
+    :return: dictionary mapping array names to (read-only, memory-mapped) numpy arrays, or None if there is no model at
+     path or it was built from a different text or with different parameters
+    """
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r") as meta_file:
+        if json.load(meta_file) != meta:
+            return None
+
+    state = {}
+    for file_name in os.listdir(path):
+        name, ext = os.path.splitext(file_name)
+        if ext == ".npy":
+            state[name] = np.load(os.path.join(path, file_name), mmap_mode='r')
+    return state
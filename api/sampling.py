@@ -0,0 +1,96 @@
+"""
+This stores the sampling engine that draws the next word of each sequence from the conditional probabilities of its
+suggested words (see Book.generate_batch and Book.stream).
+
+All randomness comes from numpy.random.Generator objects passed in by the caller, never from the global np.random
+state, and each draw only involves the probabilities of its own sequence (one segment of the probability array) and one
+uniform number from that sequence's Generator. A sequence therefore generates the same words whether it is generated
+alone, in a batch with others, or in another process, as long as it gets a Generator seeded the same way (see
+sequence_rngs).
+
+A draw inverts the cumulative sum of the segment at the uniform number; truncated words keep their place in the
+segment with a weight of 0, so no index arrays are rebuilt. Settings (applied in this order):
+    temperature     sharpens (< 1) or flattens (> 1) the distribution, p ** (1 / temperature); 0 always picks the most
+                    likely word
+    top_k           only the top_k most likely words may be drawn (ties are broken by position)
+    top_p           only the most likely words whose cumulative probability (after top_k) reaches top_p may be drawn
+                    (nucleus sampling); the most likely word is always kept
+"""
+
+import numpy as np
+
+
+def sequence_rngs(seed, n, start=0):
+    """
+    :param seed: integer seed, or None for fresh entropy
+    :param n: number of sequences
+    :param start: position of the first sequence, so that a run split into several parts (e.g. over processes) gets the
+     same Generators as one run of all of the sequences
+    :return: list of n Generators, where the i-th sequence's Generator only depends on seed and start + i
+    """
+    return [np.random.default_rng(None if seed is None else [seed, i]) for i in range(start, start + n)]
+
+
+def check_settings(temperature=1., top_k=None, top_p=None):
+    """
+    :raise ValueError: if a setting is out of range
+    """
+    if temperature < 0:
+        raise ValueError("temperature must be >= 0, got {}".format(temperature))
+    if top_k is not None and top_k < 1:
+        raise ValueError("top_k must be >= 1, got {}".format(top_k))
+    if top_p is not None and not 0 < top_p <= 1:
+        raise ValueError("top_p must be in (0, 1], got {}".format(top_p))
+
+
+def truncate_segment(probabilities, temperature=1., top_k=None, top_p=None):
+    """
+    :param probabilities: array of the probabilities of one sequence's suggested words
+    :return: new array of (unnormalized) weights of the same length, with the temperature applied and the truncated
+     words set to 0
+    """
+    if temperature == 0:
+        weights = np.zeros(len(probabilities))
+        weights[np.argmax(probabilities)] = 1.
+        return weights
+    if temperature != 1:
+        # relative to the largest probability, so that the weights can't all underflow to 0
+        weights = (probabilities / probabilities.max()) ** (1 / temperature)
+    else:
+        weights = probabilities.copy()
+    if top_k is None and top_p is None:
+        return weights
+
+    order = np.argsort(-weights, kind="stable")  # most likely first
+    num_kept = len(weights)
+    if top_k is not None:
+        num_kept = min(num_kept, top_k)
+    if top_p is not None:
+        cumulative = np.cumsum(weights[order[:num_kept]])
+        # keep words until the cumulative weight reaches top_p of the total weight left after top_k
+        num_kept = min(num_kept, np.searchsorted(cumulative, top_p * cumulative[-1], side="left") + 1)
+    weights[order[num_kept:]] = 0
+    return weights
+
+
+def sample_segments(cond_prob_arr, offsets, uniforms, temperature=1., top_k=None, top_p=None):
+    """
+    Draws one index per sequence, where sequence b draws from cond_prob_arr[offsets[b]:offsets[b + 1]] by inverting
+    its cumulative sum at uniforms[b], after applying the settings (see the module docstring).
+    :param cond_prob_arr: array of the conditional probabilities of the suggested words of all sequences, concatenated
+    :param offsets: number of sequences + 1 offsets into cond_prob_arr
+    :param uniforms: array of one uniform [0, 1) random number per sequence
+    :return: array of indices into cond_prob_arr, one per sequence
+    """
+    truncate = temperature != 1 or top_k is not None or top_p is not None
+    idx = np.empty(len(offsets) - 1, dtype=np.int64)
+    for b in range(len(idx)):
+        weights = cond_prob_arr[offsets[b]:offsets[b + 1]]
+        if truncate:
+            weights = truncate_segment(weights, temperature, top_k, top_p)
+        cumulative = np.cumsum(weights)
+        i = np.searchsorted(cumulative, uniforms[b] * cumulative[-1], side='right')
+        if i == len(cumulative):  # uniforms[b] * total rounded up to the total: take the last word that may be drawn
+            i = np.flatnonzero(weights)[-1] if truncate else i - 1
+        idx[b] = offsets[b] + i
+    return idx
@@ -0,0 +1,258 @@
+"""
+This stores the local HTTP server that serves text generation from preloaded book models.
+
+The books are loaded once (through a Librarian) when the server starts and kept in memory. Each book has a batcher
+thread that collects the /generate requests arriving within a short window and generates all of them with one call to
+Book.generate_batch, so concurrent requests share their scoring steps. Only the standard library is used, and the
+server listens on localhost by default:
+
+    python -m api.server --book "Frankenstein, by Mary Wollstonecraft (Godwin) Shelley" --port 8000
+
+Endpoints (all responses are JSON):
+    GET /generate?book=<name_author>&n=<number of words>&seed=<integer>
+        generates n words from the book; requests with the same seed get the same words, which are also the words of
+        the first sequence of `python -m ml_ngrams generate --seed <seed>` (both seed their generators with
+        sampling.sequence_rngs). book may be left out if only one book is loaded, and a seed is drawn (and returned) if
+        it is left out
+    GET /books      names of the loaded books
+    GET /stats      request counts, batch sizes and latency percentiles
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from api import sampling
+
+default_host = "127.0.0.1"
+default_port = 8000
+default_batch_window = 0.005  # seconds to wait for more requests after the first request of a batch arrives
+default_max_batch = 64  # maximum number of requests generated together
+default_max_words = 1000  # maximum n of a request
+latency_window = 10000  # number of most recent requests the latency percentiles are computed over
+latency_percentiles = (50, 90, 99)
+
+
+class _Request:
+    """A pending /generate request: filled in by the batcher thread, which then sets done."""
+
+    def __init__(self, n, seed):
+        self.n = n
+        self.seed = seed
+        self.words = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class BookBatcher:
+    """
+    Queue of /generate requests for one book, served by a daemon thread that generates the requests in batches.
+    """
+
+    def __init__(self, book, batch_window=default_batch_window, max_batch=default_max_batch, max_suggested=1000):
+        """
+        :param book: trained Book object
+        :param batch_window: seconds to wait for more requests after the first request of a batch arrives
+        :param max_batch: maximum number of requests generated together
+        :param max_suggested: maximum number of suggested words scored per word generated (see Book.generate_batch)
+        """
+        self.book = book
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_suggested = max_suggested
+        self.batch_sizes = deque(maxlen=latency_window)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def generate(self, n, seed):
+        """
+        Queues a request and blocks until it has been generated.
+        :param n: number of words to generate
+        :param seed: integer seed of the request's random number generator
+        :return: list of n words
+        """
+        request = _Request(n, seed)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.words
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.batch_window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            self.batch_sizes.append(len(batch))
+            try:
+                # every request has its own generator, so its words don't depend on the rest of the batch
+                words = self.book.generate_batch(extend_by=max(request.n for request in batch),
+                                                 rng=[sampling.sequence_rngs(request.seed, 1)[0] for request in batch],
+                                                 as_words=True, max_suggested=self.max_suggested)
+                for request, request_words in zip(batch, words):
+                    request.words = request_words[:request.n]
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+
+
+class InferenceServer(ThreadingHTTPServer):
+    """
+    HTTP server generating text from a fixed set of trained books (see the module docstring for the endpoints).
+    """
+    daemon_threads = True
+
+    def __init__(self, books, host=default_host, port=default_port, batch_window=default_batch_window,
+                 max_batch=default_max_batch, max_words=default_max_words):
+        """
+        :param books: dictionary mapping name_author to trained Book objects (e.g. Librarian.acquired_books)
+        :param host: address to listen on
+        :param port: port to listen on (0 picks a free port, see server_address)
+        :param batch_window: see BookBatcher
+        :param max_batch: see BookBatcher
+        :param max_words: maximum n of a request
+        """
+        ThreadingHTTPServer.__init__(self, (host, port), _Handler)
+        self.batchers = {name_author: BookBatcher(book, batch_window, max_batch) for name_author, book in books.items()}
+        self.max_words = max_words
+        self.started = time.time()
+        self.num_requests = 0
+        self.num_errors = 0
+        self.latencies = deque(maxlen=latency_window)
+        self._stats_lock = threading.Lock()
+
+    def record(self, latency, error=False):
+        with self._stats_lock:
+            self.num_requests += 1
+            self.num_errors += error
+            self.latencies.append(latency)
+
+    def stats(self):
+        """
+        :return: dictionary with the request and error counts, the latency percentiles (in milliseconds) over the most
+         recent requests, and the mean batch size of each book
+        """
+        with self._stats_lock:
+            latencies = np.array(self.latencies) * 1e3
+            stats = {"uptime": time.time() - self.started, "requests": self.num_requests, "errors": self.num_errors}
+        stats["latency_ms"] = {"p{}".format(q): float(np.percentile(latencies, q)) if len(latencies) else None
+                               for q in latency_percentiles}
+        stats["mean_batch_size"] = {name_author: float(np.mean(batcher.batch_sizes)) if batcher.batch_sizes else None
+                                    for name_author, batcher in self.batchers.items()}
+        return stats
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/generate":
+            start = time.perf_counter()
+            status, body = self._generate(parse_qs(url.query))
+            self.server.record(time.perf_counter() - start, error=status != 200)
+        elif url.path == "/books":
+            status, body = 200, {"books": list(self.server.batchers)}
+        elif url.path == "/stats":
+            status, body = 200, self.server.stats()
+        else:
+            status, body = 404, {"error": "Unknown path {}".format(url.path)}
+        self._send_json(status, body)
+
+    def _generate(self, query):
+        """
+        :param query: parsed query string of a /generate request
+        :return: (HTTP status, response dictionary) tuple
+        """
+        batchers = self.server.batchers
+        name_author = query.get("book", [None])[0]
+        if name_author is None and len(batchers) == 1:
+            name_author = next(iter(batchers))
+        if name_author not in batchers:
+            return 404, {"error": "Unknown book {!r}; see /books".format(name_author)}
+        try:
+            n = int(query.get("n", ["20"])[0])
+            seed = int(query["seed"][0]) if "seed" in query else np.random.SeedSequence().entropy
+        except ValueError:
+            return 400, {"error": "n and seed must be integers"}
+        if not 0 < n <= self.server.max_words or seed < 0:
+            return 400, {"error": "n must be between 1 and {} and seed must not be negative".format(
+                self.server.max_words)}
+
+        try:
+            words = batchers[name_author].generate(n, seed)
+        except Exception as e:
+            return 500, {"error": "{}: {}".format(type(e).__name__, e)}
+        return 200, {"book": name_author, "n": n, "seed": seed, "text": " ".join(words), "words": words}
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass  # don't print a line per request
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve text generation from Project Gutenberg books over HTTP")
+    parser.add_argument("--book", action="append", required=True,
+                        help='book to load, as "<title>, by <author>" (repeat for more books)')
+    parser.add_argument("--host", default=default_host)
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--truncate", type=float, default=0.4)
+    parser.add_argument("--alpha", type=float, default=1)
+    parser.add_argument("--max-chain", type=int, default=10)
+    parser.add_argument("--cache", default="cache", help="directory of the cached books, models and index")
+    parser.add_argument("--workers", type=int, default=1, help="number of books acquired and built in parallel")
+    parser.add_argument("--corpus", action="store_true", help="also serve a corpus merged from all of the books")
+    parser.add_argument("--batch-window", type=float, default=default_batch_window * 1e3, help="in milliseconds")
+    parser.add_argument("--max-batch", type=int, default=default_max_batch)
+    args = parser.parse_args(argv)
+
+    from api.librarian import Librarian
+    book_list = [tuple(name_author.rsplit(", by ", 1)) for name_author in args.book]
+    librarian = Librarian(book_list, global_truncate=args.truncate, global_alpha=args.alpha,
+                          global_max_chain=args.max_chain, num_workers=args.workers, cache_dir=args.cache)
+    books = dict(librarian.acquired_books)
+    if args.corpus:
+        corpus = librarian.build_corpus()
+        books[corpus.name_author] = corpus
+    if len(books) == 0:
+        print("None of the books could be loaded")
+        return
+
+    server = InferenceServer(books, args.host, args.port, args.batch_window / 1e3, args.max_batch)
+    print("Serving {} on http://{}:{}/".format(", ".join(books), *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
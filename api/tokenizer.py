@@ -0,0 +1,112 @@
+"""
+This stores the tokenizer that splits book text into words.
+
+Instead of one re.sub pass over the whole text per contraction, the text is lowercased and then goes through three
+whole-string passes: one compiled regex finds every word containing an apostrophe and replaces it through a lookup in
+the contractions dictionary, str.translate deletes the remaining apostrophes, and re.findall splits out the words.
+Because whole words are looked up, contractions are word-bounded (e.g. "he's" is not expanded inside "the's").
+"""
+
+import re
+
+default_chunk_size = 1 << 20  # characters read at a time by iter_file_tokens
+
+contractions = {
+    "aren't": "are not",
+    "can't": "cannot",
+    "couldn't": "could not",
+    "didn't": "did not",
+    "doesn't": "does not",
+    "don't": "dont",  # Special case to not change; as in: why don't you do something doesn't translate well to why
+    "hadn't": "had not",  # do not you do something.
+    "hasn't": "has not",
+    "haven't": "have not",
+    "he'd": "he would",
+    "he'll": "he will",
+    "he's": "he is",
+    "i'd": 'i would',
+    "i'll": "i will",
+    "i'm": "i am",
+    "i've": "i have",
+    "isn't": "is not",
+    "let's": "let us",
+    "mightn't": "might not",
+    "mustn't": "must not",
+    "shan't": "shall not",
+    "she'd": "she would",
+    "she'll": "she will",
+    "she's": "she is",
+    "shouldn't": "should not",
+    "that's": "that is",
+    "there's": "there is",
+    "they'd": "they would",
+    "they'll": "they will",
+    "they're": "they are",
+    "they've": "they have",
+    "we'd": "we would",
+    "we're": "we are",
+    "we've": "we have",
+    "weren't": "were not",
+    "what'll": "what will",
+    "what're": "what are",
+    "what's": "what is",
+    "what've": "what have",
+    "where's": "where is",
+    "who'd": "who would",
+    "who'll": "who will",
+    "who're": "who are",
+    "who's": "who is",
+    "who've": "who have",
+    "won't": "will not",
+    "wouldn't": "would not",
+    "you'd": "you would",
+    "you'll": "you will",
+    "you're": "you are",
+    "you've": "you have"
+}
+
+# a word containing an apostrophe, not preceded or followed by a letter or digit (quotation marks around it are allowed)
+_contraction_re = re.compile(r"(?<![a-z0-9])(?<![a-z0-9]')[a-z]+'[a-z]+(?!'?[a-z0-9])")
+_delete_apostrophes = str.maketrans("", "", "'")
+_word_re = re.compile(r"[a-z0-9]+")
+# the (possibly incomplete) word at the end of a chunk of text
+_trailing_word_re = re.compile(r"[a-z0-9']+\Z")
+
+
+def _expand_contraction(match):
+    return contractions.get(match.group(), match.group())
+
+
+def tokenize(s):
+    """
+    Splits s into words: the text is lowercased, contractions are expanded, apostrophes are deleted and all other non
+    alphanumeric characters separate words.
+    :param s: string of text
+    :return: list of words
+    """
+    s = _contraction_re.sub(_expand_contraction, s.lower())
+    return _word_re.findall(s.translate(_delete_apostrophes))
+
+
+def iter_file_tokens(file_obj, chunk_size=default_chunk_size):
+    """
+    Streaming variant of tokenize that reads file_obj chunk_size characters at a time, so that the text never has to
+    be held in memory as one string. A word that runs up to the end of a chunk is held back until the next chunk so
+    that words are never split across chunks.
+    :param file_obj: file object opened in text mode
+    :param chunk_size: number of characters to read at a time
+    :return: generator of words
+    """
+    carry = ""
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            break
+        text = carry + chunk.lower()
+        trailing_word = _trailing_word_re.search(text)
+        cut = trailing_word.start() if trailing_word else len(text)
+        # keep the character before the held back word so that the contraction regex sees the same word boundary
+        cut = max(cut - 1, 0)
+        yield from tokenize(text[:cut])
+        carry = text[cut:]
+    yield from tokenize(carry)
@@ -0,0 +1,61 @@
+"""
+Reports how much memory compressing the distance graphs (Book.compress) saves against how much it changes the
+generated-vs-actual word frequency metric (see api/compression.py), for a few compression settings on a synthetic
+corpus.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_compression --num-words 200000 --max-chain 15 --output compression.json
+"""
+
+import argparse
+import io
+import json
+from contextlib import redirect_stdout
+
+from api.book import Book
+from api.compression import compression_report
+from benchmarks.corpus import synthetic_text
+
+
+def default_settings(max_chain):
+    """
+    :return: list of compression settings: narrow dtypes, minimum counts on the far distances, top-k rows, and both
+    """
+    far = [None] + [2] * (max_chain - 1)  # leave distance 1 (the suggested words) alone
+    return [
+        {"dtype": "uint8"},
+        {"min_count": far},
+        {"min_count": far, "dtype": "uint8"},
+        {"top_k": [None] + [32] * (max_chain - 1)},
+        {"min_count": [None] + [3] * (max_chain - 1), "dtype": "uint8"},
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-words", type=int, default=200000)
+    parser.add_argument("--max-chain", type=int, default=15)
+    parser.add_argument("--vocabulary-size", type=int, default=20000)
+    parser.add_argument("--num-samples", type=int, default=200, help="generated sequences per setting")
+    parser.add_argument("--extend-by", type=int, default=20)
+    parser.add_argument("--output", help="also write the report as JSON here")
+    args = parser.parse_args()
+
+    with redirect_stdout(io.StringIO()):  # silence the progress prints
+        book = Book("synthetic", {}, truncate=0.01, max_chain=args.max_chain,
+                    book_text=synthetic_text(args.num_words, args.vocabulary_size))
+    settings = default_settings(args.max_chain)
+    report = compression_report(book, settings, args.num_samples, args.extend_by)
+
+    print("{} tokens, vocabulary of {}, max_chain={}".format(book.num_words, book.vocabulary_size, args.max_chain))
+    for row, options in zip(report, ["uncompressed"] + settings):
+        print("{:>10.2f} MB ({:5.1%} saved)  frequency distance {:.4f} ({:+.4f})  {}".format(
+            row["graph_bytes"] / 1e6, row["saved_fraction"], row["frequency_distance"],
+            row["frequency_distance_change"], options))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
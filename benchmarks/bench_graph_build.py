@@ -0,0 +1,55 @@
+"""
+Compares the vectorized COO/CSR build of the distance graphs (Book._make_bayesian_graphs) against the dok_matrix
+reference implementation (Book._make_bayesian_graphs_dok), and checks that both produce the same counts.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_graph_build --num-words 50000 --max-chain 15
+"""
+
+import argparse
+import time
+from contextlib import redirect_stdout
+import io
+
+from api.book import Book
+from benchmarks.corpus import synthetic_text
+
+
+def make_book(num_words, max_chain, vocabulary_size):
+    book = Book("synthetic", {}, do_make_book=False, truncate=0., max_chain=max_chain,
+                book_text=synthetic_text(num_words, vocabulary_size))
+    book._make_tokens()
+    book._make_vocab()
+    return book
+
+
+def time_build(book, build):
+    with redirect_stdout(io.StringIO()):  # silence the progress prints
+        start = time.perf_counter()
+        build()
+        elapsed = time.perf_counter() - start
+    return elapsed, book.graphs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-words", type=int, default=50000)
+    parser.add_argument("--max-chain", type=int, default=15)
+    parser.add_argument("--vocabulary-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    book = make_book(args.num_words, args.max_chain, args.vocabulary_size)
+    dok_time, dok_graphs = time_build(book, book._make_bayesian_graphs_dok)
+    csr_time, csr_graphs = time_build(book, book._make_bayesian_graphs)
+
+    for d, (dok_graph, csr_graph) in enumerate(zip(dok_graphs, csr_graphs)):
+        if (dok_graph.tocsr() != csr_graph).nnz != 0:
+            raise AssertionError("graph for distance {} differs between the dok and csr builds".format(d + 1))
+
+    print("{} tokens, vocabulary of {}, max_chain={}".format(book.num_words, book.vocabulary_size, args.max_chain))
+    print("dok build: {:.3f} s".format(dok_time))
+    print("csr build: {:.3f} s ({:.1f}x faster)".format(csr_time, dok_time / csr_time))
+
+
+if __name__ == "__main__":
+    main()
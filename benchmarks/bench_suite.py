@@ -0,0 +1,217 @@
+"""
+Times the hot paths of a Book on synthetic corpora (no network needed) and reports the results as JSON, so that runs on
+different commits can be diffed or compared with --compare:
+    parse               Book._parse of the whole text
+    make_tokens         Book._make_tokens
+    make_graphs         Book._make_bayesian_graphs
+    cond_prob           Book.generate_cond_prob_arr for the successors of randomly chosen contexts
+    apply_naive_bayes   Book.apply_naive_bayes (plots go to the non-interactive Agg backend)
+
+For each benchmark and each combination of corpus size and max_chain, the wall time (the minimum over --repeat runs),
+the peak memory allocated while running (from tracemalloc, in a separate run) and the throughput in tokens per second
+are reported; "tokens" are the words of the text for parse, make_tokens and make_graphs, the suggested words scored for
+cond_prob and the words generated for apply_naive_bayes.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_suite --num-words 20000 100000 --max-chain 2 10 --output bench.json
+    python -m benchmarks.bench_suite --output new.json --compare bench.json
+"""
+
+import argparse
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+import matplotlib
+
+matplotlib.use("Agg")  # apply_naive_bayes plots; never open a window
+
+import matplotlib.pyplot as plt
+import numpy as np
+import scipy
+
+from api.book import Book
+from benchmarks.corpus import synthetic_text
+
+benchmark_names = ("parse", "make_tokens", "make_graphs", "cond_prob", "apply_naive_bayes")
+default_regression_threshold = 1.2  # --compare flags wall times that grew by more than this factor
+
+
+def new_book(text, max_chain):
+    return Book("synthetic", {}, do_make_book=False, truncate=0.01, max_chain=max_chain, book_text=text, seed=0)
+
+
+def trained_book(text, max_chain):
+    book = new_book(text, max_chain)
+    with redirect_stdout(io.StringIO()):
+        book.make_book(None)
+    return book
+
+
+def cond_prob_cases(book, num_cases=50, max_suggested=1000):
+    """
+    :return: list of (tuple_s, list_p_forward) arguments of generate_cond_prob_arr: the previous max_chain words at
+     random positions in the text and the words that follow the last of them
+    """
+    rng = np.random.default_rng(0)
+    cases = []
+    for start in rng.integers(0, book.num_words - book.max_chain, size=num_cases).tolist():
+        context = book.token_ids[start:start + book.max_chain]
+        cand_ids = book._candidate_ids(context, max_suggested, rng)
+        cases.append((tuple(book.words[i] for i in cand_ids.tolist()), [book.words[i] for i in context.tolist()]))
+    return cases
+
+
+def setup_benchmark(name, text, max_chain, extend_by):
+    """
+    Prepares everything a benchmark needs that should not be timed.
+    :return: (function to time, number of tokens it processes) tuple
+    """
+    if name == "parse":
+        return (lambda: Book._parse(text)), len(Book._parse(text))
+    if name == "make_tokens":
+        book = new_book(text, max_chain)
+        return book._make_tokens, len(Book._parse(text))
+    if name == "make_graphs":
+        book = new_book(text, max_chain)
+        book._make_tokens()
+        book._make_vocab()
+        return book._make_bayesian_graphs, book.num_words
+    book = trained_book(text, max_chain)
+    if name == "cond_prob":
+        cases = cond_prob_cases(book)
+
+        def run():
+            book.sum_w_d_p_list_s_cache.clear()
+            for tuple_s, list_p_forward in cases:
+                book.generate_cond_prob_arr(tuple_s, list_p_forward)
+        return run, sum(len(tuple_s) for tuple_s, _ in cases)
+    if name == "apply_naive_bayes":
+        def run():
+            book.apply_naive_bayes(extend_by=extend_by, rng=np.random.default_rng(0))
+            plt.close("all")
+        return run, extend_by
+    raise ValueError("Unknown benchmark {}".format(name))
+
+
+def measure(name, text, max_chain, repeat, extend_by):
+    """
+    :return: dictionary of the wall time, peak memory and throughput of one benchmark
+    """
+    wall_times = []
+    for _ in range(repeat):
+        run, num_tokens = setup_benchmark(name, text, max_chain, extend_by)
+        with redirect_stdout(io.StringIO()):  # silence the progress prints
+            start = time.perf_counter()
+            run()
+            wall_times.append(time.perf_counter() - start)
+
+    # tracemalloc slows allocation down, so peak memory is measured in a separate run
+    run, num_tokens = setup_benchmark(name, text, max_chain, extend_by)
+    tracemalloc.start()
+    with redirect_stdout(io.StringIO()):
+        run()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    wall_time = min(wall_times)
+    return {
+        "wall_time_s": wall_time,
+        "median_wall_time_s": float(np.median(wall_times)),
+        "peak_memory_bytes": peak_memory,
+        "tokens": num_tokens,
+        "tokens_per_s": num_tokens / wall_time if wall_time > 0 else None,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+            "scipy": scipy.__version__, "machine": platform.machine()}
+
+
+def run_suite(num_words_list, max_chains, benchmarks=benchmark_names, vocabulary_size=5000, repeat=3, extend_by=50):
+    """
+    Runs every benchmark for every combination of corpus size and max_chain.
+    :return: list of result dictionaries
+    """
+    results = []
+    for num_words in num_words_list:
+        text = synthetic_text(num_words, vocabulary_size)
+        for max_chain in max_chains:
+            for name in benchmarks:
+                if name in ("parse", "make_tokens") and max_chain != max_chains[0]:
+                    continue  # these don't depend on max_chain
+                result = {"benchmark": name, "num_words": num_words, "max_chain": max_chain}
+                result.update(measure(name, text, max_chain, repeat, extend_by))
+                print("{benchmark:>18} num_words={num_words:<8} max_chain={max_chain:<3} {wall_time_s:9.4f} s "
+                      "{peak_memory_bytes:>12,} B peak {tokens_per_s:14,.0f} tokens/s".format(**result),
+                      file=sys.stderr)
+                results.append(result)
+    return results
+
+
+def compare(results, baseline, threshold=default_regression_threshold):
+    """
+    Prints the change in wall time of every benchmark that is also in baseline.
+    :return: list of the results whose wall time grew by more than threshold
+    """
+    def key(result):
+        return result["benchmark"], result["num_words"], result["max_chain"]
+
+    baseline_by_key = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = baseline_by_key.get(key(result))
+        if old is None:
+            continue
+        ratio = result["wall_time_s"] / old["wall_time_s"]
+        flag = ""
+        if ratio > threshold:
+            regressions.append(result)
+            flag = "  REGRESSION"
+        print("{:>18} num_words={:<8} max_chain={:<3} {:9.4f} s -> {:9.4f} s ({:.2f}x){}".format(
+            *key(result), old["wall_time_s"], result["wall_time_s"], ratio, flag), file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-words", type=int, nargs="+", default=[20000, 100000])
+    parser.add_argument("--max-chain", type=int, nargs="+", default=[2, 10])
+    parser.add_argument("--benchmark", nargs="+", choices=benchmark_names, default=list(benchmark_names))
+    parser.add_argument("--vocabulary-size", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--extend-by", type=int, default=50, help="words generated by apply_naive_bayes")
+    parser.add_argument("--output", help="write the JSON report here instead of to stdout")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare the wall times against")
+    parser.add_argument("--threshold", type=float, default=default_regression_threshold,
+                        help="slowdown factor reported as a regression by --compare (exit status 1)")
+    args = parser.parse_args()
+
+    results = run_suite(args.num_words, args.max_chain, args.benchmark, args.vocabulary_size, args.repeat,
+                        args.extend_by)
+    report = {"environment": environment(), "parameters": vars(args), "results": results}
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=1, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=1, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            if compare(results, json.load(baseline_file), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
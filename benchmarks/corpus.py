@@ -0,0 +1,39 @@
+"""
+Synthetic corpora for the benchmarks, so that they can run without downloading anything from Project Gutenberg.
+"""
+
+import numpy as np
+
+# a handful of real words so that the generated text exercises the contraction handling in Book._parse
+common_words = ["the", "and", "of", "to", "a", "i", "in", "was", "that", "my", "me", "with", "had", "but", "he's",
+                "which", "you", "his", "it", "not", "as", "for", "on", "by", "can't", "this", "from", "be", "her",
+                "is", "she", "at", "when", "or", "so", "were", "your", "would", "i'm", "all", "have", "him", "no"]
+
+
+def synthetic_words(num_words, vocabulary_size=5000, seed=0):
+    """
+    Draws num_words words from a Zipf-like distribution over a vocabulary of vocabulary_size words, which roughly
+    matches the word frequency distribution of a novel.
+    :param num_words: length of the text in words
+    :param vocabulary_size: number of distinct words to draw from
+    :param seed: seed for the random number generator
+    :return: list of words
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = common_words + ["w{}".format(i) for i in range(max(vocabulary_size - len(common_words), 0))]
+    vocabulary = vocabulary[:vocabulary_size]
+    weights = 1. / np.arange(1, len(vocabulary) + 1)
+    ids = rng.choice(len(vocabulary), size=num_words, p=weights / weights.sum())
+    return [vocabulary[i] for i in ids]
+
+
+def synthetic_text(num_words, vocabulary_size=5000, seed=0, words_per_line=12):
+    """
+    Same as synthetic_words, but joined into lines of text with some punctuation, like a book file.
+    :return: string
+    """
+    words = synthetic_words(num_words, vocabulary_size, seed)
+    lines = []
+    for i in range(0, len(words), words_per_line):
+        lines.append(" ".join(words[i:i + words_per_line]).capitalize() + ".")
+    return "\n".join(lines)
@@ -23,5 +23,5 @@ if __name__ == "__main__":
         print('Generate another sample? (y or Y) -> ')
         while True:
             i = input()
-            if i == "y" or "Y":
+            if i in ("y", "Y"):
                 break
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+Command line interface to the book models (run from the repository root):
+
+    python -m ml_ngrams index frankenstein --field title --prefix
+    python -m ml_ngrams build "Frankenstein, by Mary Wollstonecraft (Godwin) Shelley" --workers 2
+    python -m ml_ngrams generate "Frankenstein, by Mary Wollstonecraft (Godwin) Shelley" -n 3 --seed 0
+
+Only the standard library is imported up front; each subcommand imports what it needs (generate never imports
+matplotlib or requests, and index never imports scipy), and the Gutenberg index is only opened when a book has to be
+looked up, i.e. when generate or build has to download a book that isn't cached. build trains the books and writes their compiled
+models, which generate then memory-maps instead of rebuilding, so both must be run with the same --truncate and
+--max-chain. Progress messages go to stderr and results to stdout; --timings reports the import and startup times of
+the run on stderr.
+"""
+
+import time
+
+cli_start = time.perf_counter()
+
+import argparse
+import contextlib
+import os
+import sys
+
+default_cache_path = "cache"
+title_author_separator = ", by "
+
+
+class Timings:
+    """
+    Wall times of the named phases of one run, in the order they ran.
+    """
+
+    def __init__(self):
+        self.phases = []  # list of (name, seconds) tuples
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def report(self):
+        """
+        :return: one line listing each phase and the time since the command line interface was started, in ms
+        """
+        parts = ["{} {:.1f} ms".format(name, seconds * 1e3) for name, seconds in self.phases]
+        parts.append("total {:.1f} ms".format((time.perf_counter() - cli_start) * 1e3))
+        return "timings: " + ", ".join(parts)
+
+
+def generate(args, timings):
+    with timings.phase("import"):
+        from api import gutindex, sampling
+        from api.book import Book, InvalidBookError
+    with timings.phase("load"), contextlib.redirect_stdout(sys.stderr):
+        os.makedirs(os.path.join(args.cache, "books"), exist_ok=True)
+        try:
+            gutenberg_index = gutindex.LazyIndex(os.path.join(args.cache, "gutindex"),
+                                                 os.path.join(args.cache, "GUTINDEX.txt"))
+            book = Book(args.book, gutenberg_index, truncate=args.truncate, alpha=args.alpha,
+                        max_chain=args.max_chain, use_compiled_model=True, cache_dir=args.cache)
+        except InvalidBookError:
+            raise SystemExit("Unable to acquire {}".format(args.book))
+    with timings.phase("generate"):
+        seeds = None
+        if args.prompt is not None:
+            words, ids = book.encode(args.prompt)
+            if len(ids) < book.max_chain or (ids[-book.max_chain:] < 0).any():
+                raise SystemExit("The prompt must end with at least {} words of the book's vocabulary"
+                                 .format(book.max_chain))
+            seeds = [ids] * args.n
+        # one Generator per sequence, so that each sequence only depends on the seed and its position
+        generated = book.generate_batch(seeds, extend_by=args.extend_by, rng=sampling.sequence_rngs(args.seed, args.n),
+                                        as_words=True, max_suggested=args.max_suggested,
+                                        temperature=args.temperature, top_k=args.top_k, top_p=args.top_p)
+    for words in generated:
+        print(" ".join(words))
+
+
+def build(args, timings):
+    with timings.phase("import"):
+        from api.librarian import Librarian
+    with timings.phase("build"), contextlib.redirect_stdout(sys.stderr):
+        os.makedirs(os.path.join(args.cache, "books"), exist_ok=True)
+        book_list = [tuple(name_author.rsplit(title_author_separator, 1)) for name_author in args.book]
+        librarian = Librarian(book_list, cache_dir=args.cache, global_truncate=args.truncate, global_alpha=args.alpha,
+                              global_max_chain=args.max_chain, num_workers=args.workers)
+    for name_author, book in librarian.acquired_books.items():
+        print("built\t{}\t{} words, vocabulary of {}".format(name_author, book.num_words, book.vocabulary_size))
+    for name_author, reason in librarian.failed_books.items():
+        print("failed\t{}\t{}".format(name_author, reason))
+    if librarian.failed_books:
+        sys.exit(1)
+
+
+def index(args, timings):
+    with timings.phase("import"):
+        from api import gutindex
+    with timings.phase("open"), contextlib.redirect_stdout(sys.stderr):
+        gutenberg_index = gutindex.open_index(os.path.join(args.cache, "gutindex"),
+                                              os.path.join(args.cache, "GUTINDEX.txt"), rebuild=args.rebuild)
+        if gutenberg_index is None:
+            raise SystemExit("Could not open the Gutenberg index")
+    if args.query is None:
+        return
+    with timings.phase("lookup"):
+        matches = gutenberg_index.lookup(args.query, field=args.field, prefix=args.prefix,
+                                         case_sensitive=args.case_sensitive)
+    for name_author, number in matches[:args.limit]:
+        print("{}\t{}".format(number, name_author))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m ml_ngrams", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cache", default=default_cache_path, help="directory of the cached books, models and index")
+    parser.add_argument("--timings", action="store_true", help="report import and startup times on stderr")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    model_options = argparse.ArgumentParser(add_help=False)  # must match between build and generate
+    model_options.add_argument("--truncate", type=float, default=0.4)
+    model_options.add_argument("--max-chain", type=int, default=10)
+    model_options.add_argument("--alpha", type=float, default=1)
+
+    generate_parser = subparsers.add_parser("generate", parents=[model_options],
+                                            help="generate text from a book (built and cached on first use)")
+    generate_parser.add_argument("book", help='"<title>, by <author>"')
+    generate_parser.add_argument("-n", type=int, default=1, help="number of sequences")
+    generate_parser.add_argument("--extend-by", type=int, default=50, help="words per sequence")
+    generate_parser.add_argument("--seed", type=int, help="random seed; the same seed gives the same text")
+    generate_parser.add_argument("--prompt", help="text to continue (drawn from the book if left out)")
+    generate_parser.add_argument("--max-suggested", type=int, default=1000)
+    generate_parser.add_argument("--temperature", type=float, default=1., help="0 always picks the most likely word")
+    generate_parser.add_argument("--top-k", type=int, help="only draw from the top k most likely words")
+    generate_parser.add_argument("--top-p", type=float, help="only draw from the most likely words up to probability p")
+    generate_parser.set_defaults(run=generate)
+
+    build_parser = subparsers.add_parser("build", parents=[model_options],
+                                         help="download books and write their compiled models")
+    build_parser.add_argument("book", nargs="+", help='"<title>, by <author>"')
+    build_parser.add_argument("--workers", type=int, default=1, help="number of books built in parallel")
+    build_parser.set_defaults(run=build)
+
+    index_parser = subparsers.add_parser("index", help="look books up in the Project Gutenberg index")
+    index_parser.add_argument("query", nargs="?", help="leave out to only build the index")
+    index_parser.add_argument("--field", choices=("name_author", "title", "author"), default="name_author")
+    index_parser.add_argument("--prefix", action="store_true", help="match everything starting with the query")
+    index_parser.add_argument("--case-sensitive", action="store_true")
+    index_parser.add_argument("--limit", type=int, default=50, help="maximum number of matches listed")
+    index_parser.add_argument("--rebuild", action="store_true", help="rebuild the index from GUTINDEX.txt")
+    index_parser.set_defaults(run=index)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    timings = Timings()
+    with timings.phase("startup"):
+        args = parse_args(argv)
+    try:
+        args.run(args, timings)
+    finally:
+        if args.timings:
+            print(timings.report(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
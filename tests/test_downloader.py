@@ -0,0 +1,134 @@
+"""
+Tests of api/downloader.py against a local stand-in for the Project Gutenberg mirror (a stdlib http.server that serves
+byte ranges).
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from api.downloader import Downloader, DownloadError
+
+header = "The Project Gutenberg EBook of Test\nLicense blurb\n*** START OF THIS PROJECT GUTENBERG EBOOK TEST ***\n"
+body = "".join("Line {} of the book, with café in it.\n".format(i) for i in range(2000))
+footer = "*** END OF THIS PROJECT GUTENBERG EBOOK TEST ***\nMore license text\n"
+book_bytes = (header + body + footer).encode("utf-8")
+
+
+class _MirrorHandler(BaseHTTPRequestHandler):
+    """Serves the files of the server's files dictionary (path -> bytes), honouring "Range: bytes=<start>-"."""
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        range_header = self.headers.get("Range")
+        if range_header is not None and self.server.supports_ranges:
+            start = int(range_header[len("bytes="):].rstrip("-"))
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{}".format(len(content)))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, len(content) - 1, len(content)))
+            content = content[start:]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloaderTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _MirrorHandler)
+        self.server.files = {}
+        self.server.requests = []
+        self.server.supports_ranges = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "book.txt")
+        self.session = requests.Session()
+        self.downloader = Downloader("http://127.0.0.1:{}".format(self.server.server_address[1]),
+                                     session=self.session, chunk_size=1024)
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def read_book(self):
+        with open(self.path, encoding="utf-8") as book_file:
+            return book_file.read()
+
+    def test_strips_header_and_footer(self):
+        self.server.files["/1/2/3/1234/1234.txt"] = book_bytes
+        self.downloader.download_book("1234", self.path)
+        self.assertEqual(self.read_book(), body)
+        self.assertEqual(os.listdir(self.directory), ["book.txt"])  # no .part or temporary files are left behind
+
+    def test_falls_back_to_utf8_link(self):
+        self.server.files["/1/2/3/1234/1234-0.txt"] = book_bytes
+        self.downloader.download_book("1234", self.path)
+        self.assertEqual(self.read_book(), body)
+        self.assertEqual([path for path, _ in self.server.requests],
+                         ["/1/2/3/1234/1234.txt", "/1/2/3/1234/1234-0.txt"])
+
+    def test_skips_html_page(self):
+        self.server.files["/1/2/3/1234/1234.txt"] = b"  <!DOCTYPE html><html><body>Not here</body></html>"
+        self.server.files["/1/2/3/1234/1234-0.txt"] = book_bytes
+        self.downloader.download_book("1234", self.path)
+        self.assertEqual(self.read_book(), body)
+
+    def test_resumes_partial_download(self):
+        self.server.files["/1/2/3/1234/1234.txt"] = book_bytes
+        part_path = self.path + ".1234.txt.part"
+        with open(part_path, "wb") as part_file:
+            part_file.write(book_bytes[:5000])
+        self.downloader.download_book("1234", self.path)
+        self.assertEqual(self.server.requests, [("/1/2/3/1234/1234.txt", "bytes=5000-")])
+        self.assertEqual(self.read_book(), body)
+        self.assertFalse(os.path.exists(part_path))
+
+    def test_complete_part_file(self):
+        self.server.files["/1/2/3/1234/1234.txt"] = book_bytes
+        with open(self.path + ".1234.txt.part", "wb") as part_file:
+            part_file.write(book_bytes)
+        self.downloader.download_book("1234", self.path)  # the server answers 416
+        self.assertEqual(self.read_book(), body)
+
+    def test_server_without_range_support(self):
+        self.server.files["/1/2/3/1234/1234.txt"] = book_bytes
+        self.server.supports_ranges = False
+        with open(self.path + ".1234.txt.part", "wb") as part_file:
+            part_file.write(book_bytes[:5000])
+        self.downloader.download_book("1234", self.path)  # the whole file is sent again and overwrites the part
+        self.assertEqual(self.read_book(), body)
+
+    def test_latin1_text(self):
+        self.server.files["/1/2/3/1234/1234.txt"] = (header + body + footer).encode("latin-1")
+        self.downloader.download_book("1234", self.path)
+        self.assertEqual(self.read_book(), body)
+
+    def test_missing_book(self):
+        with self.assertRaises(DownloadError):
+            self.downloader.download_book("1234", self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
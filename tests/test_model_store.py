@@ -0,0 +1,65 @@
+"""
+Tests that compiled models (see api/model_store.py) are memory-mapped when they match the book and rebuilt otherwise.
+"""
+
+import contextlib
+import io
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from api.book import Book
+from api.model_store import _MappedGraph
+
+text = " ".join("the {} cat sat on the mat and the dog ran to the cat while the bird sang {}".format(i % 7, i % 3)
+                for i in range(200))
+
+
+class CompiledModelTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def book(self, book_text=text, truncate=0.01, max_chain=3, compression=None):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return Book("test", {}, book_text=book_text, truncate=truncate, max_chain=max_chain,
+                        compression=compression, use_compiled_model=True, cache_dir=self.cache_dir)
+
+    def assert_loaded(self, book, loaded):
+        self.assertEqual(isinstance(book.graphs[0], _MappedGraph), loaded)
+
+    def test_same_parameters_load_the_model(self):
+        built = self.book()
+        self.assert_loaded(built, False)
+        loaded = self.book()
+        self.assert_loaded(loaded, True)
+        np.testing.assert_array_equal(loaded.token_ids, built.token_ids)
+        self.assertEqual(loaded.words, built.words)
+        for loaded_graph, built_graph in zip(loaded.graphs, built.graphs):
+            self.assertEqual((loaded_graph.tocsr() != built_graph).nnz, 0)
+
+    def test_changed_parameters_rebuild_the_model(self):
+        changes = {
+            "truncate": {"truncate": 0.02},
+            "max_chain": {"max_chain": 4},
+            "text": {"book_text": text + " one more sentence"},
+            "compression": {"compression": {"min_count": 2}},
+        }
+        for name, change in changes.items():
+            with self.subTest(name):
+                self.book()
+                self.assert_loaded(self.book(**change), False)
+                self.assert_loaded(self.book(**change), True)  # the rebuilt model replaced the old one
+
+    def test_different_compression_settings(self):
+        self.book(compression={"min_count": 2})
+        self.assert_loaded(self.book(compression={"min_count": 3}), False)
+        self.assert_loaded(self.book(compression={"min_count": 3}), True)
+
+
+if __name__ == "__main__":
+    unittest.main()
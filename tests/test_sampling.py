@@ -0,0 +1,56 @@
+"""
+Tests that seeded generation (see api/sampling.py) gives the same words whether sequences are streamed, generated
+alone, in one batch, or in a batch split into parts.
+"""
+
+import contextlib
+import io
+import unittest
+
+import numpy as np
+
+from api import sampling
+from api.book import Book
+
+text = " ".join("the {} cat sat on the {} mat and the dog ran to the cat while the bird sang {}".format(
+    i % 7, i % 5, i % 3) for i in range(300))
+
+
+class SeededGenerationTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with contextlib.redirect_stdout(io.StringIO()):
+            cls.book = Book("test", {}, book_text=text, truncate=0, max_chain=3)
+
+    def generate(self, seed, n, start=0, extend_by=12, **settings):
+        # max_suggested=4 so that the suggested words are sampled too
+        return self.book.generate_batch(n=n, extend_by=extend_by, rng=sampling.sequence_rngs(seed, n, start),
+                                        max_suggested=4, **settings)
+
+    def test_single_batched_split_and_streamed_runs_agree(self):
+        for settings in ({}, {"temperature": 0.5, "top_k": 3}, {"top_p": 0.8}, {"temperature": 0}):
+            with self.subTest(**settings):
+                batch = self.generate(7, 6, **settings)
+                np.testing.assert_array_equal(np.vstack((self.generate(7, 2, 0, **settings),
+                                                         self.generate(7, 4, 2, **settings))), batch)
+                for i in range(6):
+                    np.testing.assert_array_equal(self.generate(7, 1, i, **settings)[0], batch[i])
+                    streamed = self.book.stream(extend_by=12, rng=sampling.sequence_rngs(7, 1, i)[0], as_words=False,
+                                                max_suggested=4, **settings)
+                    self.assertEqual(list(streamed), batch[i].tolist())
+
+    def test_shorter_run_is_a_prefix(self):
+        np.testing.assert_array_equal(self.generate(3, 4, extend_by=5), self.generate(3, 4, extend_by=12)[:, :5])
+
+    def test_seeds_differ(self):
+        self.assertFalse(np.array_equal(self.generate(1, 4), self.generate(2, 4)))
+
+    def test_global_state_is_not_used(self):
+        np.random.seed(0)
+        first = self.generate(5, 3)
+        np.random.seed(1)
+        np.testing.assert_array_equal(self.generate(5, 3), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
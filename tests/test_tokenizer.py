@@ -0,0 +1,43 @@
+"""
+Tests of api/tokenizer.py.
+"""
+
+import io
+import unittest
+
+from api.tokenizer import iter_file_tokens, tokenize
+
+text = ("It's a truth universally acknowledged, that a single man... \"Don't,\" she said; 'they're here' -- "
+        "the cat's toy, can't-stop 1818 rock'n'roll THE END's\nWe'll see. O'Brien couldn't. Isn't it?  'Tis so.\n")
+
+
+class TokenizeTest(unittest.TestCase):
+    def test_contractions_and_punctuation(self):
+        self.assertEqual(tokenize("Don't you think it's fine? They're 'here', 3 cats."),
+                         ["dont", "you", "think", "its", "fine", "they", "are", "here", "3", "cats"])
+
+    def test_contractions_are_word_bounded(self):
+        self.assertEqual(tokenize("the's he's"), ["thes", "he", "is"])
+
+
+class IterFileTokensTest(unittest.TestCase):
+    def test_matches_tokenize_at_every_chunk_size(self):
+        expected = tokenize(text)
+        for chunk_size in range(1, len(text) + 2):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(list(iter_file_tokens(io.StringIO(text), chunk_size=chunk_size)), expected)
+
+    def test_contraction_split_across_chunks(self):
+        for split_text in ("aaaa can't bbbb", "aaaa they're bbbb", "x 'they're' y"):
+            expected = tokenize(split_text)
+            for chunk_size in range(1, len(split_text) + 1):
+                with self.subTest(text=split_text, chunk_size=chunk_size):
+                    self.assertEqual(list(iter_file_tokens(io.StringIO(split_text), chunk_size=chunk_size)),
+                                     expected)
+
+    def test_empty_file(self):
+        self.assertEqual(list(iter_file_tokens(io.StringIO(""))), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+Tests that Book.update gives the same model as building the book from the combined text.
+"""
+
+import contextlib
+import io
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from api.book import Book
+
+text1 = " ".join("the {} cat sat on the mat and the dog ran to the cat".format(i % 5) for i in range(100))
+text2 = " ".join("a bird sang to the cat while the {} fox slept near a new tree".format(i % 4) for i in range(60))
+
+
+def build(text, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Book("test", {}, book_text=text, truncate=0, max_chain=4, **kwargs)
+
+
+class UpdateTest(unittest.TestCase):
+    def assert_same_model(self, book, expected):
+        self.assertEqual(book.words, expected.words)
+        np.testing.assert_array_equal(book.token_ids, expected.token_ids)
+        np.testing.assert_array_equal(book.word_counts, expected.word_counts)
+        self.assertEqual(book.num_words, expected.num_words)
+        self.assertEqual(book.vocabulary_size, expected.vocabulary_size)
+        for graph, expected_graph in zip(book.graphs, expected.graphs):
+            self.assertEqual(graph.shape, expected_graph.shape)
+            self.assertEqual((graph.tocsr() != expected_graph.tocsr()).nnz, 0)
+        np.testing.assert_array_equal(book.successor_offsets, expected.successor_offsets)
+        np.testing.assert_array_equal(book.successor_ids, expected.successor_ids)
+
+    def test_update_matches_combined_build(self):
+        book = build(text1)
+        self.assertEqual(book.update(text2), len(text2.split()))
+        self.assert_same_model(book, build(text1 + "\n" + text2))
+
+    def test_several_updates(self):
+        book = build(text1)
+        for part in text2.split(" while "):
+            book.update(part)
+        self.assert_same_model(book, build(text1 + " " + " ".join(text2.split(" while "))))
+
+    def test_empty_update(self):
+        book = build(text1)
+        self.assertEqual(book.update("  ...  "), 0)
+        self.assert_same_model(book, build(text1))
+
+    def test_update_refreshes_precomputed_tables(self):
+        book = build(text1, precompute=True, normalize_graphs=True)
+        book.update(text2)
+        expected = build(text1 + "\n" + text2, precompute=True, normalize_graphs=True)
+        np.testing.assert_allclose(book.log_prior, expected.log_prior)
+        for row_sums, expected_row_sums in zip(book.row_sums, expected.row_sums):
+            np.testing.assert_allclose(row_sums, expected_row_sums)
+        self.assertAlmostEqual(book.score(text2[:200])["log_prob"], expected.score(text2[:200])["log_prob"])
+
+    def test_update_of_compiled_model(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            build(text1, use_compiled_model=True, cache_dir=cache_dir)
+            book = build(text1, use_compiled_model=True, cache_dir=cache_dir)  # memory-mapped, read-only arrays
+            book.update(text2)
+            self.assert_same_model(book, build(text1 + "\n" + text2))
+        finally:
+            shutil.rmtree(cache_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()